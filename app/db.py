@@ -0,0 +1,276 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+DB_DIR = os.environ.get("DB_DIR") or ("/app/data" if os.path.exists("/app") else "data")
+DB_PATH = f"{DB_DIR}/music.db"
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",  # Readers never wait on the writer
+    "PRAGMA synchronous = NORMAL",  # Safe with WAL, far fewer fsyncs
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",  # 8 MB page cache per connection
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA recursive_triggers = ON",  # REPLACE fires delete triggers too
+)
+
+# Applied in order; PRAGMA user_version records how many have run. Append
+# new migrations, never edit old ones. Version 1 is written with IF NOT
+# EXISTS so databases created before migrations existed upgrade cleanly.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS downloads (
+        id TEXT PRIMARY KEY,
+        title TEXT,
+        uploader TEXT,
+        duration INTEGER,
+        url TEXT,
+        filepath TEXT,
+        downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_downloads_title_uploader
+        ON downloads (title, uploader);
+    CREATE INDEX IF NOT EXISTS idx_downloads_downloaded_at
+        ON downloads (downloaded_at);
+
+    CREATE TABLE IF NOT EXISTS plays (
+        id INTEGER PRIMARY KEY,
+        video_id TEXT,
+        title TEXT,
+        uploader TEXT,
+        added_by TEXT,
+        event TEXT NOT NULL,  -- 'play' when a track starts, 'skip' when skipped
+        position REAL,
+        played_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_plays_played_at ON plays (played_at);
+    CREATE INDEX IF NOT EXISTS idx_plays_title_uploader
+        ON plays (title, uploader, played_at);
+    -- Downloads were the only listening history so far
+    INSERT INTO plays (video_id, title, uploader, event, played_at)
+        SELECT id, title, uploader, 'play', CAST(strftime('%s', downloaded_at) AS REAL)
+        FROM downloads WHERE downloaded_at IS NOT NULL;
+
+    CREATE TABLE IF NOT EXISTS resolve_queries (
+        query TEXT PRIMARY KEY,
+        video_id TEXT NOT NULL,
+        created_at REAL,
+        last_used REAL
+    );
+    CREATE TABLE IF NOT EXISTS resolved_tracks (
+        video_id TEXT PRIMARY KEY,
+        info TEXT NOT NULL,
+        stream_url TEXT,
+        stream_expires REAL,
+        last_used REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_resolve_queries_last_used
+        ON resolve_queries (last_used);
+    CREATE INDEX IF NOT EXISTS idx_resolved_tracks_last_used
+        ON resolved_tracks (last_used);
+
+    CREATE TABLE IF NOT EXISTS download_jobs (
+        video_id TEXT PRIMARY KEY,
+        webpage_url TEXT NOT NULL,
+        title TEXT,
+        artist TEXT,
+        duration INTEGER,
+        target_dir TEXT,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        not_before REAL NOT NULL DEFAULT 0,
+        error TEXT,
+        bytes INTEGER,
+        created_at REAL,
+        started_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_download_jobs_pending
+        ON download_jobs (status, priority, created_at);
+
+    CREATE TABLE IF NOT EXISTS lastfm_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE downloads ADD COLUMN album TEXT;  -- NULL until read from info JSON
+    ALTER TABLE downloads ADD COLUMN year TEXT;
+
+    CREATE VIRTUAL TABLE library_fts USING fts5 (
+        video_id UNINDEXED,
+        title,
+        artist,
+        album,
+        year,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '1 2 3'
+    );
+    CREATE VIRTUAL TABLE library_vocab USING fts5vocab (library_fts, row);
+    INSERT INTO library_fts (video_id, title, artist, album, year)
+        SELECT id, title, uploader, album, year FROM downloads;
+
+    CREATE TRIGGER downloads_fts_insert AFTER INSERT ON downloads BEGIN
+        INSERT INTO library_fts (video_id, title, artist, album, year)
+            VALUES (new.id, new.title, new.uploader, new.album, new.year);
+    END;
+    CREATE TRIGGER downloads_fts_delete AFTER DELETE ON downloads BEGIN
+        DELETE FROM library_fts WHERE video_id = old.id;
+    END;
+    CREATE TRIGGER downloads_fts_update AFTER UPDATE ON downloads BEGIN
+        DELETE FROM library_fts WHERE video_id = old.id;
+        INSERT INTO library_fts (video_id, title, artist, album, year)
+            VALUES (new.id, new.title, new.uploader, new.album, new.year);
+    END;
+    """,
+    """
+    ALTER TABLE downloads ADD COLUMN missing_since REAL;  -- File gone from disk
+    CREATE INDEX idx_downloads_filepath ON downloads (filepath);
+
+    -- Library scanner fingerprints: a directory whose mtime is unchanged has
+    -- the same entries, so it is not listed again
+    CREATE TABLE library_dirs (
+        path TEXT PRIMARY KEY,
+        parent TEXT,
+        mtime REAL NOT NULL
+    );
+    CREATE INDEX idx_library_dirs_parent ON library_dirs (parent);
+    CREATE TABLE library_files (
+        path TEXT PRIMARY KEY,
+        dir TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        video_id TEXT
+    );
+    CREATE INDEX idx_library_files_dir ON library_files (dir);
+    """,
+    """
+    -- Latest engine state per section (queue, now, history, suggested) as
+    -- JSON, so a restarted engine picks up where it left off
+    CREATE TABLE engine_state (
+        section TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        saved_at REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE downloads ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0;  -- Never evicted
+    ALTER TABLE downloads ADD COLUMN evicted_at REAL;  -- Audio deleted by the quota
+    ALTER TABLE downloads ADD COLUMN evicted_bytes INTEGER;
+    CREATE INDEX idx_plays_video_id ON plays (video_id, event, played_at);
+    """,
+    """
+    -- Search rows share their download's rowid: keeping them in step is a
+    -- rowid lookup instead of a scan of the whole index, and only when a
+    -- searched column changes (not for pins or missing/evicted marks)
+    DROP TRIGGER downloads_fts_insert;
+    DROP TRIGGER downloads_fts_delete;
+    DROP TRIGGER downloads_fts_update;
+    DELETE FROM library_fts;
+    INSERT INTO library_fts (rowid, video_id, title, artist, album, year)
+        SELECT rowid, id, title, uploader, album, year FROM downloads;
+
+    CREATE TRIGGER downloads_fts_insert AFTER INSERT ON downloads BEGIN
+        INSERT INTO library_fts (rowid, video_id, title, artist, album, year)
+            VALUES (new.rowid, new.id, new.title, new.uploader, new.album, new.year);
+    END;
+    CREATE TRIGGER downloads_fts_delete AFTER DELETE ON downloads BEGIN
+        DELETE FROM library_fts WHERE rowid = old.rowid;
+    END;
+    CREATE TRIGGER downloads_fts_update
+    AFTER UPDATE OF id, title, uploader, album, year ON downloads
+    WHEN old.id IS NOT new.id OR old.title IS NOT new.title
+        OR old.uploader IS NOT new.uploader OR old.album IS NOT new.album
+        OR old.year IS NOT new.year
+    BEGIN
+        DELETE FROM library_fts WHERE rowid = old.rowid;
+        INSERT INTO library_fts (rowid, video_id, title, artist, album, year)
+            VALUES (new.rowid, new.id, new.title, new.uploader, new.album, new.year);
+    END;
+    """,
+]
+
+
+class TimedConnection(sqlite3.Connection):
+    """Reports how long each execute() takes (up to its first result row)"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.sqlite_seconds.observe(time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.sqlite_seconds.observe(time.perf_counter() - started)
+
+
+_pool = queue.LifoQueue()
+_created = 0
+_created_lock = threading.Lock()
+
+
+def _open():
+    conn = sqlite3.connect(
+        DB_PATH, timeout=5, check_same_thread=False, factory=TimedConnection
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; commits on success, rolls back on error"""
+    global _created
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        with _created_lock:
+            grow = _created < POOL_SIZE
+            if grow:
+                _created += 1
+        if not grow:
+            conn = _pool.get()
+        else:
+            try:
+                conn = _open()
+            except Exception:
+                with _created_lock:
+                    _created -= 1
+                raise
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _pool.put(conn)
+
+
+def init_db():
+    """Create the database and apply any pending migrations"""
+    os.makedirs(DB_DIR, exist_ok=True)
+    with connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # executescript commits first, so each migration is its own
+            # transaction together with its user_version bump
+            conn.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;"
+            )
+            print(f"🗄️ Applied database migration {number}")
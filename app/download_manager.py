@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+
+import db
+
+# Lower runs first
+DOWNLOAD_NOW = 0  # Currently playing
+DOWNLOAD_NEXT = 1  # Next up in the queue
+DOWNLOAD_USER = 2  # Queued by a guest
+DOWNLOAD_AUTOPLAY = 3  # Autoplay filler
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 60  # Seconds, multiplied by the attempt number
+JOB_FIELDS = ("video_id", "webpage_url", "title", "artist", "duration", "target_dir")
+
+
+class DownloadManager:
+    """Persistent, prioritized download queue backed by download_jobs
+
+    Jobs survive restarts (anything left "running" is requeued on startup).
+    While the current track is streamed from the network only the current
+    and next-up tracks download, rate-limited to `streaming_ratelimit`
+    bytes/s, so filler downloads don't starve playback.
+    """
+
+    def __init__(self, download, workers=1, streaming_ratelimit=None, on_done=None):
+        self._download = download
+        self._on_done = on_done  # Called after each finished download
+        self.workers = workers
+        self.streaming_ratelimit = streaming_ratelimit
+        self._cond = threading.Condition()
+        self._streaming = False
+        self._progress = {}  # video_id -> progress of running jobs
+
+    def start(self):
+        # Resume whatever was interrupted by the last shutdown
+        with db.connection() as conn:
+            resumed = conn.execute(
+                "UPDATE download_jobs SET status = 'queued' WHERE status = 'running'"
+            ).rowcount
+        if resumed:
+            print(f"⬇️ Resuming {resumed} interrupted download(s)")
+        for i in range(self.workers):
+            threading.Thread(
+                target=self._work, name=f"download-{i}", daemon=True
+            ).start()
+        return self
+
+    def enqueue(self, job, priority=DOWNLOAD_AUTOPLAY):
+        """Add a job, or requeue a finished/failed one whose file is missing"""
+        now = time.time()
+        with self._cond, db.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO download_jobs
+                    (video_id, webpage_url, title, artist, duration, target_dir,
+                     priority, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (video_id) DO UPDATE SET
+                    priority = MIN(priority, excluded.priority),
+                    attempts = CASE WHEN status IN ('queued', 'running')
+                        THEN attempts ELSE 0 END,
+                    not_before = CASE WHEN status IN ('queued', 'running')
+                        THEN not_before ELSE 0 END,
+                    status = CASE WHEN status = 'running'
+                        THEN status ELSE 'queued' END
+                """,
+                (*(job[field] for field in JOB_FIELDS), priority, now),
+            )
+            self._cond.notify_all()
+
+    def prioritize(self, video_id, priority):
+        """Move a waiting job up, e.g. when its track becomes next up"""
+        if not video_id:
+            return
+        with self._cond, db.connection() as conn:
+            changed = conn.execute(
+                "UPDATE download_jobs SET priority = ? WHERE video_id = ? AND priority > ?",
+                (priority, video_id, priority),
+            ).rowcount
+            if changed:
+                self._cond.notify_all()
+
+    def set_streaming(self, streaming):
+        """Tell the manager whether playback is currently using the network"""
+        with self._cond:
+            if streaming != self._streaming:
+                self._streaming = streaming
+                self._cond.notify_all()
+
+    def counts(self):
+        """Jobs per status (queued, running, done, failed)"""
+        with db.connection() as conn:
+            return dict(
+                conn.execute(
+                    "SELECT status, COUNT(*) FROM download_jobs GROUP BY status"
+                ).fetchall()
+            )
+
+    def status(self):
+        now = time.time()
+        with db.connection() as conn:
+            counts = dict(
+                conn.execute(
+                    "SELECT status, COUNT(*) FROM download_jobs GROUP BY status"
+                ).fetchall()
+            )
+            done_bytes, done_count = conn.execute(
+                "SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM download_jobs WHERE status = 'done' AND finished_at > ?",
+                (now - 600,),
+            ).fetchone()
+            queued = conn.execute(
+                "SELECT video_id, title, artist, priority, attempts, error FROM download_jobs WHERE status = 'queued' ORDER BY priority, created_at LIMIT 20"
+            ).fetchall()
+            failed = conn.execute(
+                "SELECT video_id, title, artist, error FROM download_jobs WHERE status = 'failed' ORDER BY finished_at DESC LIMIT 10"
+            ).fetchall()
+        with self._cond:
+            active = list(self._progress.values())
+            streaming = self._streaming
+        return {
+            "workers": self.workers,
+            "streaming": streaming,
+            "counts": counts,
+            "active": active,
+            "queued": [
+                dict(
+                    zip(
+                        (
+                            "video_id",
+                            "title",
+                            "artist",
+                            "priority",
+                            "attempts",
+                            "error",
+                        ),
+                        row,
+                    )
+                )
+                for row in queued
+            ],
+            "failed": [
+                dict(zip(("video_id", "title", "artist", "error"), row))
+                for row in failed
+            ],
+            # Over the last 10 minutes
+            "completed_10m": done_count,
+            "throughput_bps": round(done_bytes / 600),
+        }
+
+    def _claim(self):
+        """Wait for the most urgent runnable job and mark it running"""
+        with self._cond:
+            while True:
+                now = time.time()
+                streaming = self._streaming
+                with db.connection() as conn:
+                    # Only what's playing or next may compete with a stream
+                    max_priority = DOWNLOAD_NEXT if streaming else DOWNLOAD_AUTOPLAY
+                    row = conn.execute(
+                        f"SELECT {', '.join(JOB_FIELDS)}, priority FROM download_jobs WHERE status = 'queued' AND priority <= ? AND not_before <= ? ORDER BY priority, created_at LIMIT 1",
+                        (max_priority, now),
+                    ).fetchone()
+                    if row:
+                        conn.execute(
+                            "UPDATE download_jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE video_id = ?",
+                            (now, row[0]),
+                        )
+                        job = dict(zip((*JOB_FIELDS, "priority"), row))
+                        self._progress[job["video_id"]] = {
+                            "video_id": job["video_id"],
+                            "title": job["title"],
+                            "artist": job["artist"],
+                            "priority": job["priority"],
+                            "downloaded_bytes": 0,
+                            "total_bytes": None,
+                            "speed": None,
+                        }
+                        return job, streaming
+                    retry_at = conn.execute(
+                        "SELECT MIN(not_before) FROM download_jobs WHERE status = 'queued' AND not_before > ?",
+                        (now,),
+                    ).fetchone()[0]
+                self._cond.wait(timeout=retry_at - now if retry_at else None)
+
+    def _work(self):
+        while True:
+            job, streaming = self._claim()
+            video_id = job["video_id"]
+
+            def on_progress(d, video_id=video_id):
+                progress = self._progress.get(video_id)
+                if progress is not None:
+                    progress["downloaded_bytes"] = d.get("downloaded_bytes") or 0
+                    progress["total_bytes"] = d.get("total_bytes") or d.get(
+                        "total_bytes_estimate"
+                    )
+                    progress["speed"] = d.get("speed")
+
+            ratelimit = self.streaming_ratelimit if streaming else None
+            try:
+                filepath = self._download(
+                    job, ratelimit=ratelimit, progress_hook=on_progress
+                )
+                self._finish(video_id, "done", size=_file_size(filepath))
+            except Exception as e:
+                print(f"Download failed: {e}")
+                self._finish(video_id, "failed", error=str(e)[:500])
+                continue
+            if self._on_done:
+                try:
+                    self._on_done()
+                except Exception as e:
+                    print(f"After-download hook failed: {e}")
+
+    def _finish(self, video_id, status, size=None, error=None):
+        now = time.time()
+        with self._cond, db.connection() as conn:
+            self._progress.pop(video_id, None)
+            if status == "failed":
+                # Retry with a growing delay until MAX_ATTEMPTS is reached
+                conn.execute(
+                    "UPDATE download_jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, not_before = ? + attempts * ?, error = ?, finished_at = ? WHERE video_id = ?",
+                    (MAX_ATTEMPTS, now, RETRY_DELAY, error, now, video_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE download_jobs SET status = ?, bytes = ?, error = NULL, finished_at = ? WHERE video_id = ?",
+                    (status, size, now, video_id),
+                )
+            self._cond.notify_all()
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
@@ -0,0 +1,1578 @@
+"""Player engine: owns mpv, the queue and every background thread
+
+Runs as its own process (`python engine.py`) or inside `python jukebox.py`;
+web workers talk to it over the ENGINE_SOCK Unix socket (see
+engine_client.py) and never hold any state themselves.
+"""
+
+import glob
+import json
+import os
+import queue as q
+import random
+import re
+import socket
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+
+import db
+from download_manager import (
+    DOWNLOAD_NEXT,
+    DOWNLOAD_NOW,
+    DOWNLOAD_USER,
+    DownloadManager,
+)
+from engine_client import ENGINE_SOCK
+import library
+import metrics
+from library_scanner import LibraryScanner
+from lastfm import API_URL as LASTFM_API_URL
+from lastfm import LastFmClient
+from mpv_ipc import MpvClient, MpvError
+from play_queue import PlayQueue, song_key
+from recommender import LocalRecommender
+from resolve_cache import (
+    ResolveCache,
+    normalize_query,
+    stream_url_expiry,
+    stream_url_fresh,
+)
+from state_journal import StateJournal
+from storage_quota import StorageQuota
+from resolver import (
+    PRIORITY_AUTOPLAY,
+    PRIORITY_BATCH,
+    PRIORITY_PLAY_NEXT,
+    PRIORITY_USER,
+    ResolverBusy,
+    ResolverPool,
+)
+from ytdl_pool import CookieWatcher, YoutubeDLPool
+
+# Use Termux path if running on Android, otherwise use /tmp
+default_sock = (
+    "/data/data/com.termux/files/usr/tmp/mpv.sock"
+    if os.path.exists("/data/data/com.termux")
+    else "/tmp/mpv.sock"
+)
+IPC_SOCK = os.environ.get("MPV_IPC", default_sock)
+MPV_EXTRA = (
+    os.environ.get("MPV_EXTRA", "").split() if os.environ.get("MPV_EXTRA") else []
+)
+LASTFM_API_KEY = os.environ.get("LASTFM_API_KEY")
+AUTOPLAY_DEPTH = int(os.environ.get("AUTOPLAY_DEPTH", "3"))  # Songs to keep queued
+AUTOPLAY_BACKOFF = 30  # Seconds before retrying after an empty fill, doubling
+AUTOPLAY_BACKOFF_MAX = 600
+LOADFILE_ATTEMPTS = 3  # Tries at starting a track before dropping it
+LOADFILE_RETRY = 2  # Seconds between them
+PREWARM_DEPTH = int(os.environ.get("PREWARM_DEPTH", "3"))  # Queued tracks kept warm
+PREWARM_INTERVAL = 60  # Seconds between checks when nothing changes
+JOURNAL_DELAY = 1.0  # Seconds of changes batched into one state journal write
+JOURNAL_POSITION_INTERVAL = 5  # Seconds between saves of the playback position
+RESTORE_WINDOW = 3 * 3600  # Saved state older than a session isn't restored
+BATCH_MAX = int(os.environ.get("BATCH_MAX", "100"))  # Entries per batch add
+BATCHES_KEPT = 20  # Finished batches whose progress can still be read
+
+play_queue = PlayQueue()
+current = None
+played_history = []  # Track played songs in current session
+state_lock = metrics.TimedLock()
+cmd_queue = q.Queue()
+suggested_songs = set()  # Track already suggested songs
+prewarm_event = threading.Event()  # Queue changed or a stream URL went stale
+
+# Every change to now/queue/history bumps state_version so clients can ask for
+# "anything newer than N". state_cond has its own lock: it may be taken while
+# holding state_lock, never the other way round.
+state_cond = threading.Condition()
+state_version = 0
+state_epoch = uuid.uuid4().hex[:8]  # Versions restart with the process
+section_versions = {"now": 0, "queue": 0, "history": 0}
+section_cache = {}  # section -> (version, serialized JSON)
+state_journal = StateJournal()
+pending_resume = None  # Position to seek to once the restored track loads
+
+
+def mpv_start():
+    if os.path.exists(IPC_SOCK):
+        os.remove(IPC_SOCK)
+    args = [
+        "mpv",
+        "--no-video",
+        "--terminal=no",
+        "--idle=yes",
+        f"--input-ipc-server={IPC_SOCK}",
+        "--volume=100",
+        "--ytdl=no",
+        # Open the preloaded next track before this one ends (gapless)
+        "--prefetch-playlist=yes",
+        "--gapless-audio=weak",
+        "--cache=yes",
+    ] + MPV_EXTRA
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+mpv_proc = None  # Started by start()
+mpv = MpvClient(IPC_SOCK)
+
+resolve_cache = ResolveCache(
+    ttl=int(os.environ.get("RESOLVE_CACHE_TTL", str(30 * 86400))),
+    max_entries=int(os.environ.get("RESOLVE_CACHE_SIZE", "5000")),
+)
+
+
+def bump_state(*sections):
+    """Record that the given sections changed and wake the state pushers"""
+    global state_version
+    with state_cond:
+        state_version += 1
+        for section in sections:
+            section_versions[section] = state_version
+        state_cond.notify_all()
+
+
+def wait_for_state(since, timeout):
+    """Block until state_version > since (or timeout), return the version"""
+    with state_cond:
+        state_cond.wait_for(lambda: state_version > since, timeout)
+        return state_version
+
+
+def state_event(since=-1):
+    """A "state" event carrying the sections that changed after `since`
+
+    Queue and history JSON is cached per section version, so any number of
+    web workers receiving the same version costs a single json.dumps.
+    """
+    with state_cond:
+        version = state_version
+        versions = dict(section_versions)
+    parts = [
+        '"event": "state"',
+        f'"epoch": "{state_epoch}"',
+        f'"version": {version}',
+        f'"versions": {json.dumps(versions)}',
+    ]
+    with state_lock:
+        now_with_progress = current.copy() if current else None
+        for section, data in (("queue", play_queue), ("history", played_history)):
+            if versions[section] <= since:
+                continue
+            cached = section_cache.get(section)
+            if not cached or cached[0] != versions[section]:
+                cached = (versions[section], json.dumps(list(data)))
+                section_cache[section] = cached
+            parts.append(f'"{section}": {cached[1]}')
+    if since < 0 or versions["now"] > since:
+        if now_with_progress:
+            # Cached by the mpv IPC client, no socket round trip here;
+            # web workers and clients interpolate it between updates
+            now_with_progress["position"] = round(mpv.position(), 1)
+            now_with_progress["paused"] = bool(mpv.get("pause", False))
+        parts.append(f'"now": {json.dumps(now_with_progress)}')
+    return version, "{" + ", ".join(parts) + "}"
+
+
+def mpv_send(cmd):
+    # Give mpv a moment to create its socket right after startup
+    if not mpv.wait_connected(timeout=2):
+        return False
+    return mpv.send(*cmd["command"])
+
+
+def on_mpv_event(event):
+    """Forward track endings to the player thread as soon as mpv reports them"""
+    global pending_resume
+    # "stop" is a skip or a replacing loadfile, both handled by whoever sent it
+    if event.get("event") == "end-file" and event.get("reason") in ("eof", "error"):
+        cmd_queue.put(("ended", event.get("playlist_entry_id")))
+    elif event.get("event") == "property-change" and event.get("name") == "pause":
+        bump_state("now")
+    elif event.get("event") == "file-loaded" and pending_resume:
+        position, pending_resume = pending_resume, None
+        mpv.seek(position)
+        bump_state("now")
+
+
+mpv.add_listener(on_mpv_event)
+
+
+MUSIC_KEYWORDS = ["official", "music", "audio", "song", "album", "single"]
+AVOID_KEYWORDS = ["podcast", "interview", "live stream", "tutorial", "review"]
+
+
+def rank_search_entries(entries, allow_age_restricted=False):
+    """Order flat search results by how likely they are to be the song"""
+    # Filter for music: duration 30 sec - 20 min, music-related titles
+    music_entries = []
+    for entry in entries:
+        duration = entry.get("duration") or 0
+        title = (entry.get("title") or "").lower()
+        uploader = (entry.get("uploader") or entry.get("channel") or "").lower()
+
+        # Skip age-restricted content unless allowed (flat results rarely
+        # carry age_limit, so extract_best_entry checks again)
+        if (
+            not allow_age_restricted
+            and entry.get("age_limit")
+            and entry.get("age_limit") > 0
+        ):
+            continue
+
+        # Skip if too long (>20 min) or too short (<30 sec)
+        if duration and (duration > 1200 or duration < 30):
+            continue
+
+        has_music_keyword = any(
+            keyword in title or keyword in uploader for keyword in MUSIC_KEYWORDS
+        )
+        has_avoid_keyword = any(
+            keyword in title or keyword in uploader for keyword in AVOID_KEYWORDS
+        )
+
+        if has_avoid_keyword:
+            continue
+
+        music_entries.append((entry, has_music_keyword))
+
+    if music_entries:
+        # Sort by music preference (music keywords first), stable otherwise
+        music_entries.sort(key=lambda x: x[1], reverse=True)
+        return [entry for entry, _ in music_entries]
+    # Fallback to first entry if no good matches
+    return entries[:1]
+
+
+def extract_best_entry(ydl, entries, allow_age_restricted=False):
+    """Fully extract the best flat search result that turns out playable"""
+    for entry in rank_search_entries(entries, allow_age_restricted):
+        with metrics.ytdlp_seconds.time(op="extract"):
+            info = ydl.extract_info(entry.get("url") or entry["id"], download=False)
+        if (
+            not allow_age_restricted
+            and info.get("age_limit")
+            and info.get("age_limit") > 0
+        ):
+            print(f"Skipping age-restricted: {info.get('title')}")
+            continue
+        return info
+    return None
+
+
+def remember_resolved(cache_key, info, allow_age_restricted=False):
+    """Cache a resolved track under the query and its "title artist" alias"""
+    artist = info.get("artist") or info.get("uploader") or info.get("channel")
+    # Replays from history and Last.fm suggestions search by title + artist
+    alias = normalize_query(f"{info.get('title')} {artist}", allow_age_restricted)
+    try:
+        resolve_cache.put([cache_key, alias], info)
+    except Exception as e:
+        print(f"Resolve cache write failed: {e}")
+
+
+MUSIC_DIR = os.path.expanduser("~/storage/music")  # Lowercase symlink to Android Music
+
+# Add cookies if available (check multiple locations)
+COOKIE_PATHS = [
+    "cookies.txt",  # Current directory
+    os.path.expanduser("~/cookies.txt"),  # Home directory
+    "/data/data/com.termux/files/home/cookies.txt",  # Termux home
+    os.path.expanduser("~/storage/downloads/cookies.txt"),  # Android downloads
+]
+
+
+def youtube_dl(opts):
+    """yt_dlp.YoutubeDL; yt-dlp itself is only imported on first use"""
+    import yt_dlp  # Hundreds of extractor modules: seconds on a phone
+
+    return yt_dlp.YoutubeDL(opts)
+
+
+def warm_up_ytdlp():
+    """Load yt-dlp and its extractor list before the first search needs them"""
+    with metrics.startup_phase("yt-dlp warm-up"):
+        import yt_dlp
+
+        yt_dlp.extractor.gen_extractor_classes()
+        with search_pool.borrow():  # Builds the first instance, cookies loaded
+            pass
+
+
+def ydl_base_opts():
+    """yt-dlp options shared by searches and downloads (cookies are the pool's)"""
+    return {
+        "format": "bestaudio[acodec*=opus]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best",
+        "quiet": True,
+        "no_warnings": True,
+        "socket_timeout": 20,
+        "retries": 1,
+        "noplaylist": True,
+        "default_search": "ytsearch5:",  # Fewer results for faster search
+        "writeinfojson": True,
+        "writethumbnail": True,
+        "embedthumbnail": True,
+        "outtmpl": {
+            "default": "temp/search_%(title)s.%(ext)s",
+            "infojson": "temp/search_%(title)s.%(ext)s",
+            "thumbnail": "temp/search_%(title)s.%(ext)s",
+        },
+    }
+
+
+cookie_watcher = CookieWatcher(COOKIE_PATHS)
+
+
+def resolve_local(q_or_url):
+    """Library track for a YouTube URL or a query naming it; no network"""
+    try:
+        video_id = library.youtube_video_id(q_or_url)
+        if video_id:
+            return library.by_video_id(video_id)
+        if not re.match(r"https?://", q_or_url.strip()):
+            return library.match(q_or_url)
+    except Exception as e:
+        print(f"Library lookup failed: {e}")
+    return None
+
+
+def resolve_media(q_or_url, allow_age_restricted=False, fresh_until=None):
+    local = resolve_local(q_or_url)
+    if local:
+        print(f"⏭ Playing {local['title']} by {local['uploader']} from library")
+        metrics.resolve_cache_hits.inc(source="library")
+        return local
+
+    cache_key = normalize_query(q_or_url, allow_age_restricted)
+    url_video_id = library.youtube_video_id(q_or_url)
+
+    # Always search pool first, then extract pool, so borrowers can't deadlock
+    with search_pool.borrow() as search_ydl, extract_pool.borrow() as ydl:
+        try:
+            info = resolve_cache.get(cache_key)
+            if not info and url_video_id:
+                # Any URL form of a video we've resolved before
+                info = resolve_cache.get_track(url_video_id)
+            if info:
+                print(f"⚡ Resolve cache hit: {q_or_url}")
+                metrics.resolve_cache_hits.inc(source="query")
+            else:
+                with metrics.ytdlp_seconds.time(op="search"):
+                    info = search_ydl.extract_info(q_or_url, download=False)
+                if "entries" in info:
+                    info = extract_best_entry(
+                        ydl, list(info["entries"]), allow_age_restricted
+                    )
+                    if info is None:
+                        print(f"No playable search result for: {q_or_url}")
+                        metrics.resolve_failures.inc()
+                        return None
+                remember_resolved(cache_key, info, allow_age_restricted)
+
+            video_id = info.get("id")
+            title = info.get("title") or "Unknown"
+            artist = (
+                info.get("artist")
+                or info.get("uploader")
+                or info.get("channel")
+                or "Unknown"
+            )
+            album = info.get("album") or "Unknown Album"
+            release_year = info.get("release_year") or "Unknown"
+            duration = info.get("duration") or 0
+
+            # Create organized path: Artist/Year Album/
+            if (
+                artist != "Unknown"
+                and release_year != "Unknown"
+                and album != "Unknown Album"
+            ):
+                target_dir = f"{MUSIC_DIR}/{artist}/{release_year} {album}"
+            else:
+                target_dir = f"{MUSIC_DIR}/{artist}"
+
+            # Check if already downloaded
+            try:
+                existing = library.by_video_id(video_id) or library.by_title(
+                    title, artist
+                )
+                if existing:
+                    print(f"⏭ Playing {title} by {artist} from local file")
+                    return existing
+            except Exception:
+                pass
+
+            # Cached stream URLs expire after a few hours; re-extract just
+            # this video (no search) when it is about to go stale
+            if not stream_url_fresh(info, until=fresh_until):
+                print(f"♻️ Refreshing stream URL: {title}")
+                with metrics.ytdlp_seconds.time(op="extract"):
+                    info = ydl.extract_info(info["webpage_url"], download=False)
+                remember_resolved(cache_key, info, allow_age_restricted)
+
+            # Queue a background download; the player raises its priority
+            # once the track is queued by a user, next up or playing
+            download_manager.enqueue(
+                {
+                    "video_id": video_id,
+                    "webpage_url": info["webpage_url"],
+                    "title": title,
+                    "artist": artist,
+                    "duration": duration,
+                    "target_dir": target_dir,
+                }
+            )
+
+            return {
+                "video_id": video_id,
+                "title": title,
+                "uploader": artist,
+                "duration": duration,
+                "url": info.get("url"),
+                "stream_expires": info.get("stream_expires")
+                or stream_url_expiry(info.get("url")),
+                "webpage_url": info["webpage_url"],
+            }
+
+        except Exception as e:
+            print(f"yt-dlp failed: {e}")
+            metrics.resolve_failures.inc()
+            return None
+
+
+def download_track(job, ratelimit=None, progress_hook=None):
+    """Download one job into the music library and record it in downloads"""
+    target_dir = job["target_dir"]
+    artist = job["artist"]
+    title = job["title"]
+    os.makedirs(target_dir, exist_ok=True)
+
+    # Ensure metadata directory exists
+    metadata_dir = f"{target_dir}/metadata"
+    os.makedirs(metadata_dir, exist_ok=True)
+
+    # Download with organized structure
+    outtmpl = {
+        "default": f"{target_dir}/{artist} - {title}.%(ext)s",
+        "infojson": f"{metadata_dir}/{artist} - {title}.%(ext)s",
+        "thumbnail": f"{metadata_dir}/{artist} - {title}.%(ext)s",
+    }
+    with download_pool.borrow(
+        progress_hook, outtmpl=outtmpl, ratelimit=ratelimit
+    ) as download_ydl:
+        download_ydl.download([job["webpage_url"]])
+
+    # Find the downloaded file
+    audio_files = glob.glob(glob.escape(f"{target_dir}/{artist} - {title}") + ".*")
+    audio_files = [
+        f
+        for f in audio_files
+        if not f.endswith((".json", ".jpg", ".webp", ".part", ".ytdl"))
+    ]
+    if not audio_files:
+        raise RuntimeError(f"no audio file found for {artist} - {title}")
+    filepath = audio_files[0]
+
+    # Save to database
+    library.add(
+        job["video_id"], title, artist, job["duration"], job["webpage_url"], filepath
+    )
+    use_local_file(job["video_id"], filepath)
+    print(f"✓ Downloaded: {artist} - {title}")
+    return filepath
+
+
+def protected_video_ids():
+    """Tracks the storage quota must keep: playing and queued"""
+    with state_lock:
+        items = [current, *play_queue] if current else list(play_queue)
+        return {item.get("video_id") for item in items} - {None}
+
+
+storage_quota = StorageQuota(
+    int(os.environ.get("LIBRARY_QUOTA_MB", "0")) * 1024 * 1024,
+    protected=protected_video_ids,
+)
+download_manager = DownloadManager(
+    download_track,
+    workers=int(os.environ.get("DOWNLOAD_WORKERS", "1")),
+    streaming_ratelimit=int(os.environ.get("DOWNLOAD_RATELIMIT", "0")) or None,
+    on_done=storage_quota.enforce,
+)
+
+
+recommender = LocalRecommender()
+lastfm = LastFmClient(
+    LASTFM_API_KEY,
+    api_url=os.environ.get("LASTFM_API_URL", LASTFM_API_URL),
+)
+
+
+def fill_autoplay_queue():
+    """Top the queue up to AUTOPLAY_DEPTH songs (only if within same session)
+
+    Suggestions come from the local listening history first; Last.fm and
+    generic searches are only asked when it has too few. Runs on the
+    autoplay thread without holding state_lock; the lock is only taken to
+    de-duplicate and append each suggestion. Returns how many songs were
+    added, or None when autoplay doesn't apply (no history, new session).
+    """
+    added_count = 0
+    try:
+        with db.connection() as conn:
+            # Check if we're in the same session (last song < 3 hours ago)
+            last_played = conn.execute("SELECT MAX(played_at) FROM plays").fetchone()[0]
+
+            if last_played is None:
+                print("🎵 No listening history - skipping autoplay suggestions")
+                return None
+
+            hours_since = (time.time() - last_played) / 3600
+            if hours_since > 3:
+                print(
+                    f"🎵 New session detected ({hours_since:.1f}h since last song) - skipping autoplay"
+                )
+                suggested_songs.clear()  # Clear suggestions for new session
+                return None
+
+            # Only this session's plays, so the cost doesn't grow with history
+            session_start = time.time() - 3 * 3600
+            recent_songs = conn.execute(
+                "SELECT title, uploader FROM plays INDEXED BY idx_plays_played_at WHERE played_at > ? AND event = 'play' GROUP BY title, uploader ORDER BY MAX(played_at) DESC LIMIT 5",
+                (session_start,),
+            ).fetchall()
+
+            # Get all songs played in last 3 hours to avoid repeating
+            played_recently = conn.execute(
+                "SELECT DISTINCT title, uploader FROM plays WHERE played_at > ?",
+                (session_start,),
+            ).fetchall()
+        played_set = {f"{title}-{artist}" for title, artist in played_recently}
+
+        print(f"🎵 Same session ({hours_since:.1f}h ago) - adding autoplay suggestions")
+
+        with state_lock:
+            missing = AUTOPLAY_DEPTH - len(play_queue)
+            exclude = played_set | suggested_songs
+
+        # (query, library track or None, source); local tracks need no yt-dlp
+        search_options = [
+            (query, track, "history")
+            for query, track in recommender.recommend(
+                recent_songs[:3], count=missing, exclude=exclude
+            )
+        ]
+
+        if len(search_options) < missing:
+            # Too little history: Last.fm recommendations based on recent
+            # songs (last 3, in parallel)
+            remote = lastfm.recommendations(recent_songs[:3])
+
+            # Add some variety
+            remote.append(f"trending music {time.localtime().tm_year}")
+            # The latest artist's top songs (no plays yet if only a restored
+            # track has been resumed this session)
+            if recent_songs:
+                remote.append(f"{recent_songs[0][1]} top songs")
+
+            # Remove duplicates and shuffle
+            remote = list(set(remote))
+            random.shuffle(remote)
+            search_options.extend((query, None, "Last.fm") for query in remote)
+
+        for search_query, track, source in search_options:
+            with state_lock:
+                if len(play_queue) >= AUTOPLAY_DEPTH:
+                    break
+            try:
+                autoplay_meta = (
+                    track
+                    or resolver.submit(
+                        normalize_query(search_query), PRIORITY_AUTOPLAY, search_query
+                    ).result()
+                )
+                if not autoplay_meta:
+                    continue
+                song_id = f"{autoplay_meta['title']}-{autoplay_meta['uploader']}"
+
+                with state_lock:
+                    # Skip if already suggested, queued/playing, or played recently
+                    if (
+                        song_id in suggested_songs
+                        or song_id in played_set
+                        or play_queue.has_song(
+                            autoplay_meta["title"], autoplay_meta["uploader"]
+                        )
+                        or (current and song_key(current) == song_id)
+                    ):
+                        print(f"🔄 Skipping duplicate/recent: {autoplay_meta['title']}")
+                        metrics.autoplay_duplicates.inc()
+                        continue
+
+                    autoplay_item = {
+                        "id": uuid.uuid4().hex[:8],
+                        **autoplay_meta,
+                        "added_by": "autoplay",
+                    }
+                    play_queue.add_autoplay(autoplay_item)
+                    bump_state("queue")
+                    suggested_songs.add(song_id)
+                added_count += 1
+                metrics.autoplay_suggestions.inc(source=source)
+                wake_player()
+                print(
+                    f"🎵 Added via {source} ({search_query}): {autoplay_item['title']}"
+                )
+            except Exception as e:
+                print(f"Autoplay failed for {search_query}: {e}")
+    except Exception as e:
+        print(f"Fill autoplay queue failed: {e}")
+    return added_count
+
+
+def autoplay_loop():
+    """Keep AUTOPLAY_DEPTH songs queued, backing off while suggestions fail
+
+    A new track starting is a new play to suggest from, so it ends the
+    back-off; so does a fill that isn't attempted (no history, new session).
+    """
+    seen = -1
+    backoff = 0
+    retry_at = 0
+    playing = None
+    while True:
+        # Any change to the queue or current track re-checks the depth
+        timeout = max(retry_at - time.monotonic(), 0) if backoff else None
+        seen = wait_for_state(seen, timeout)
+        with state_lock:
+            missing = AUTOPLAY_DEPTH - len(play_queue)
+            track_changed = (current or {}).get("id") != playing
+            playing = (current or {}).get("id")
+        if track_changed:
+            backoff = retry_at = 0
+        if time.monotonic() < retry_at or missing <= 0:
+            continue
+        added = fill_autoplay_queue()
+        if added is None or added > 0:
+            backoff = retry_at = 0
+        else:
+            backoff = min(backoff * 2 or AUTOPLAY_BACKOFF, AUTOPLAY_BACKOFF_MAX)
+            retry_at = time.monotonic() + backoff
+
+
+# mpv's playlist as seen by the player thread (the only thread touching
+# these): the entry playing `current`, and the queue head appended after it
+current_entry = None
+preloaded = None  # {"id", "url", "entry"}
+
+
+def is_ready(item):
+    return not item.get("loading", False) and bool(item.get("url"))
+
+
+def stream_ok(item, until=None):
+    """Local files always; stream URLs while they stay valid past `until`"""
+    url = item.get("url") or ""
+    return not url.startswith("http") or stream_url_fresh(item, until=until)
+
+
+def is_playable(item):
+    # A URL the pre-warmer couldn't refresh is still worth a try
+    return is_ready(item) and (stream_ok(item) or item.get("refresh_failed", False))
+
+
+def mpv_loadfile(url, mode):
+    """loadfile and return its playlist entry id (None on mpv < 0.33)"""
+    if not mpv.wait_connected(timeout=2):
+        raise MpvError("mpv not connected")
+    return (mpv.command("loadfile", url, mode) or {}).get("playlist_entry_id")
+
+
+def is_preloaded(item):
+    """Whether mpv's preloaded entry is this queue item, at its current URL"""
+    return (item["id"], item.get("url")) == (preloaded["id"], preloaded["url"])
+
+
+def take_preloaded():
+    """Pop the queue head if it is what mpv preloaded; call with state_lock held"""
+    global current
+    head = play_queue.head()
+    if preloaded and head and is_preloaded(head):
+        current = play_queue.popleft()
+        current.pop("resume_at", None)  # Only resumed when nothing was playing
+        return current
+    return None
+
+
+def sync_preload():
+    """Keep mpv's next playlist entry in step with the head of the queue"""
+    global preloaded
+    with state_lock:
+        head = play_queue.head() if current else None
+        want = head if head and is_playable(head) else None
+    if want and preloaded and is_preloaded(want):
+        return
+    if preloaded or want:
+        # Drops everything but the playing entry: stale preloads and
+        # tracks that already finished
+        mpv_send({"command": ["playlist-clear"]})
+        preloaded = None
+    if want:
+        try:
+            entry = mpv_loadfile(want["url"], "append")
+        except MpvError as e:
+            print(f"Preloading {want['title']} failed: {e}")
+            return
+        preloaded = {"id": want["id"], "url": want["url"], "entry": entry}
+
+
+def player_loop():
+    global current, current_entry, preloaded, pending_resume
+    while True:
+        started = None
+        with state_lock:
+            # Skip loading placeholders, wait for them to resolve
+            head = play_queue.head()
+            if current is None and head and is_playable(head):
+                current = started = play_queue.popleft()
+                resume_at = started.pop("resume_at", None)
+            elif current is None and head and is_ready(head):
+                prewarm_event.set()  # Head's stream URL is stale, refresh now
+        if started:
+            preloaded = None  # replace drops the rest of mpv's playlist
+            pending_resume = resume_at  # Seeked to on file-loaded
+            try:
+                current_entry = mpv_loadfile(started["url"], "replace")
+            except MpvError as e:
+                print(f"mpv loadfile failed: {e}")
+                current_entry = pending_resume = None
+                with state_lock:
+                    current = None
+                    attempts = started.get("load_attempts", 0) + 1
+                    if attempts < LOADFILE_ATTEMPTS:
+                        started["load_attempts"] = attempts
+                        if resume_at is not None:
+                            started["resume_at"] = resume_at
+                        play_queue.requeue(started)
+                    else:
+                        print(f"⏭️ Dropping {started['title']}: mpv won't load it")
+                    bump_state("now", "queue")
+                time.sleep(LOADFILE_RETRY)  # Commands wait in cmd_queue
+                continue
+            if resume_at is None:
+                started_playing(started)
+            else:
+                print(f"▶️ Resuming {started['title']} at {resume_at:.0f}s")
+            # Once the play is recorded, so autoplay sees it when woken
+            bump_state("now", "queue")
+        sync_preload()
+        update_download_priorities()
+
+        # Block until a command or an mpv event arrives; nothing to poll
+        cmd = cmd_queue.get()
+        if cmd == "skip":
+            position = mpv.position()
+            with state_lock:
+                skipped, current = current, None
+                started = take_preloaded() if skipped else None
+                bump_state("now", "queue")
+            if started:
+                # Already buffered: switch without reopening a stream
+                mpv_send({"command": ["playlist-next", "force"]})
+                current_entry, preloaded = preloaded["entry"], None
+                started_playing(started)
+            else:
+                mpv_send({"command": ["stop"]})  # goes idle
+                preloaded = None
+            if skipped:
+                record_play(skipped, "skip", position)
+        elif cmd == "pause":
+            mpv_send({"command": ["set_property", "pause", True]})
+        elif cmd == "play":
+            mpv_send({"command": ["set_property", "pause", False]})
+        elif isinstance(cmd, tuple) and cmd[0] == "ended":
+            # Late events for an entry that's no longer playing are stale
+            if None not in (cmd[1], current_entry) and cmd[1] != current_entry:
+                continue
+            with state_lock:
+                if current:  # Add finished song to history
+                    played_history.append(current)
+                    # Keep only last 20 songs in history
+                    if len(played_history) > 20:
+                        played_history.pop(0)
+                current = None
+                # mpv has moved on to the preloaded entry by itself
+                started = take_preloaded()
+                bump_state("now", "queue", "history")
+            if started:
+                current_entry, preloaded = preloaded["entry"], None
+                started_playing(started)
+            elif preloaded:
+                # The queue changed under a preload that mpv then started
+                mpv_send({"command": ["stop"]})
+                preloaded = None
+        elif isinstance(cmd, tuple) and cmd[0] == "resolved":
+            apply_resolved(*cmd[1:])
+
+
+def started_playing(item):
+    """Log and record a track the player just started"""
+    print(f"▶️ Started playing: {item['title']}")
+    if item.get("added_at"):
+        metrics.add_to_play_seconds.observe(time.time() - item["added_at"])
+    record_play(item, "play")
+
+
+def record_play(item, event, position=None):
+    """Log a play or skip for session detection and recommendations"""
+    try:
+        with db.connection() as conn:
+            conn.execute(
+                "INSERT INTO plays (video_id, title, uploader, added_by, event, position, played_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    item.get("video_id"),
+                    item.get("title"),
+                    item.get("uploader"),
+                    item.get("added_by"),
+                    event,
+                    position,
+                    time.time(),
+                ),
+            )
+    except Exception as e:
+        print(f"Recording {event} failed: {e}")
+
+
+def wake_player():
+    """Let the player thread re-check the queue after it changed"""
+    cmd_queue.put("wake")
+    prewarm_event.set()
+
+
+def use_local_file(video_id, filepath):
+    """Point queued entries of a just-downloaded track at the local file"""
+    with state_lock:
+        changed = False
+        for item in play_queue:
+            if item.get("video_id") == video_id and item.get("url") != filepath:
+                item.update(url=filepath, stream_expires=None)
+                changed = True
+        if changed:
+            bump_state("queue")
+    if changed:
+        wake_player()
+
+
+def prewarm_targets():
+    """Copies of the next PREWARM_DEPTH ready items with their estimated end"""
+    with state_lock:
+        ends_at = time.time()
+        if current:
+            ends_at += max((current.get("duration") or 0) - mpv.position(), 0)
+        targets = []
+        for item in play_queue.peek(PREWARM_DEPTH):
+            ends_at += item.get("duration") or 0
+            if is_ready(item):
+                targets.append((dict(item), ends_at))
+    return targets
+
+
+def prewarm_item(item, ends_at, head):
+    """Swap in the local file or a stream URL valid until the track ends"""
+    video_id = item.get("video_id") or ""
+    url = item["url"]
+    local = library.by_video_id(video_id)
+    if local and local["url"] != url:
+        update = {"url": local["url"], "stream_expires": None}
+    elif local or (
+        stream_ok(item, until=ends_at)
+        if url.startswith("http")
+        else os.path.exists(url)
+    ):
+        return
+    else:
+        source = item.get("webpage_url") or (
+            f"https://www.youtube.com/watch?v={video_id}"
+            if library.VIDEO_ID_RE.match(video_id)
+            else None
+        )
+        if not source:
+            return
+        print(f"♻️ Pre-warming stream URL: {item['title']}")
+        try:
+            meta = resolver.submit(
+                f"refresh:{video_id}",
+                PRIORITY_PLAY_NEXT if head else PRIORITY_USER,
+                source,
+                False,
+                ends_at,
+            ).result()
+        except Exception as e:
+            print(f"Pre-warm failed for {item['title']}: {e}")
+            meta = None
+        if meta:
+            update = {
+                "url": meta["url"],
+                "stream_expires": meta.get("stream_expires"),
+                "refresh_failed": False,
+            }
+        else:
+            update = {"refresh_failed": True}
+    with state_lock:
+        queued = play_queue.get(item["id"])
+        # Unless it was removed or changed meanwhile
+        if queued and queued.get("url") == item["url"]:
+            queued.update(update)
+            bump_state("queue")
+    cmd_queue.put("wake")  # Not wake_player(): that would re-run the pre-warmer
+
+
+def prewarm_loop():
+    """Keep the next few queued tracks playable: local file or fresh URL"""
+    while True:
+        prewarm_event.wait(PREWARM_INTERVAL)
+        prewarm_event.clear()
+        try:
+            for i, (item, ends_at) in enumerate(prewarm_targets()):
+                prewarm_item(item, ends_at, head=i == 0)
+        except Exception as e:
+            print(f"Pre-warm error: {e}")
+
+
+download_focus = None  # (current id, next id) last reported to downloads
+
+
+def update_download_priorities():
+    """Download what's playing and next first; hold filler while streaming"""
+    global download_focus
+    with state_lock:
+        current_id = current.get("video_id") if current else None
+        streaming = bool(current) and not os.path.exists(current.get("url") or "")
+        head = play_queue.head()
+        next_id = head.get("video_id") if head else None
+    download_manager.set_streaming(streaming)
+    if (current_id, next_id) != download_focus:
+        download_focus = (current_id, next_id)
+        download_manager.prioritize(current_id, DOWNLOAD_NOW)
+        download_manager.prioritize(next_id, DOWNLOAD_NEXT)
+
+
+def apply_resolved(placeholder_id, qstr, added_by, flight):
+    """Replace a placeholder with its resolved track, or drop it on failure"""
+    try:
+        meta = flight.result()
+    except Exception as e:
+        meta = None
+        print(f"❌ Add failed for {qstr}: {e}")
+        print(f"❌ Full traceback: {traceback.format_exc()}")
+        # Also log to file
+        with open("error.log", "a") as f:
+            f.write(f"Error resolving {qstr}: {e}\n{traceback.format_exc()}\n\n")
+
+    with state_lock:
+        if meta:
+            # Update the placeholder (the loop starts it if it's first);
+            # gone if it was removed while resolving
+            added_at = (play_queue.get(placeholder_id) or {}).get("added_at")
+            play_queue.replace(
+                placeholder_id, {**meta, "added_by": added_by, "added_at": added_at}
+            )
+            print(f"✅ Resolved: {meta['title']}")
+        else:
+            # Remove placeholder if resolution failed
+            play_queue.remove(placeholder_id)
+            print(f"❌ Failed to resolve: {qstr}")
+        bump_state("queue")
+    if meta:
+        download_manager.prioritize(meta.get("video_id"), DOWNLOAD_USER)
+
+
+resolver = ResolverPool(
+    resolve_media,
+    workers=int(os.environ.get("RESOLVE_WORKERS", "2")),
+    max_backlog=int(os.environ.get("RESOLVE_BACKLOG", "32")),
+)
+# Long-lived yt-dlp instances; searches are listed flat (title/uploader/
+# duration only) and just the winning entry gets the full extraction
+search_pool = YoutubeDLPool(
+    youtube_dl,
+    {**ydl_base_opts(), "extract_flat": "in_playlist"},
+    cookie_watcher,
+    size=resolver.workers,
+)
+extract_pool = YoutubeDLPool(
+    youtube_dl, ydl_base_opts(), cookie_watcher, size=resolver.workers
+)
+download_pool = YoutubeDLPool(
+    youtube_dl, ydl_base_opts(), cookie_watcher, size=download_manager.workers
+)
+library_scanner = LibraryScanner(
+    MUSIC_DIR, interval=int(os.environ.get("LIBRARY_SCAN_INTERVAL", "600"))
+)
+
+
+def queue_length():
+    with state_lock:
+        return len(play_queue)
+
+
+metrics.Gauge("jukebox_queue_length", "Tracks waiting in the queue", queue_length)
+metrics.Gauge(
+    "jukebox_resolves_in_flight",
+    "Resolves running in the pool",
+    lambda: resolver.stats()["running"],
+)
+metrics.Gauge(
+    "jukebox_resolve_backlog",
+    "Resolves waiting for a worker",
+    lambda: resolver.stats()["backlog"],
+)
+metrics.Gauge(
+    "jukebox_download_jobs",
+    "Download jobs by status",
+    download_manager.counts,
+    label="status",
+)
+metrics.Gauge(
+    "jukebox_library_bytes",
+    "Downloaded audio on disk, counted against LIBRARY_QUOTA_MB",
+    storage_quota.used_bytes,
+)
+metrics.Gauge(
+    "jukebox_ytdlp_instances",
+    "Long-lived YoutubeDL instances built, by pool",
+    lambda: {
+        "search": search_pool.stats()["created"],
+        "extract": extract_pool.stats()["created"],
+        "download": download_pool.stats()["created"],
+    },
+    label="pool",
+)
+metrics.Gauge(
+    "jukebox_state_lock_max_hold_seconds",
+    "Longest state_lock hold since the previous scrape",
+    lambda: state_lock.take_max_hold(),
+)
+
+
+def journal_snapshot(since):
+    """The sections changed after `since`, plus the position while playing"""
+    with state_cond:
+        version = state_version
+        versions = dict(section_versions)
+    sections = {}
+    with state_lock:
+        if versions["queue"] > since:
+            sections["queue"] = play_queue.segments()
+            sections["suggested"] = sorted(suggested_songs)
+        if versions["history"] > since:
+            sections["history"] = [dict(item) for item in played_history]
+        playing = dict(current) if current else None
+    if playing or versions["now"] > since:
+        sections["now"] = {
+            "item": playing,
+            "position": round(mpv.position(), 1) if playing else None,
+        }
+    return version, sections
+
+
+def journal_loop():
+    """Save what changed at most every JOURNAL_DELAY, off the request path"""
+    seen = -1
+    while True:
+        wait_for_state(seen, JOURNAL_POSITION_INTERVAL)
+        time.sleep(JOURNAL_DELAY)  # Let a burst of changes land in one write
+        try:
+            seen, sections = journal_snapshot(seen)
+            if sections:
+                state_journal.save(sections)
+        except Exception as e:
+            print(f"State journal write failed: {e}")
+
+
+def restore_state():
+    """Queue, history and the interrupted track from before a restart
+
+    Entries keep their saved stream URLs; the pre-warmer refreshes any that
+    went stale before they play, so nothing is resolved up front.
+    """
+    try:
+        sections, saved_at = state_journal.load()
+    except Exception as e:
+        print(f"Reading saved state failed: {e}")
+        return
+    if not saved_at or time.time() - saved_at > RESTORE_WINDOW:
+        return
+    queue = sections.get("queue") or {}
+    now = sections.get("now") or {}
+    restored = 0
+    with state_lock:
+        for segment, add_item in (
+            ("user", play_queue.add_user),
+            ("autoplay", play_queue.add_autoplay),
+        ):
+            for item in queue.get(segment, []):
+                if item.get("loading"):
+                    continue  # Its resolve died with the old process
+                item.pop("added_at", None)  # Not an /add-to-play sample anymore
+                add_item(item)
+                restored += 1
+        playing = now.get("item")
+        if not (playing and is_ready(playing)) or playing["id"] in play_queue:
+            playing = None
+        if playing:
+            playing.pop("added_at", None)
+            playing["resume_at"] = now.get("position") or 0
+            play_queue.play_next(playing)
+        played_history[:] = sections.get("history", [])
+        suggested_songs.update(sections.get("suggested", []))
+        bump_state("now", "queue", "history")
+    if playing or restored:
+        print(
+            f"💾 Restored {restored} queued tracks"
+            + (f" and {playing['title']}" if playing else "")
+        )
+    wake_player()
+
+
+def start():
+    """Set up the database, start mpv and every background thread
+
+    yt-dlp loads in the background meanwhile; the first resolve waits for
+    it only if it comes before the warm-up finishes.
+    """
+    global mpv_proc
+    threading.Thread(target=warm_up_ytdlp, name="ytdlp-warm-up", daemon=True).start()
+    with metrics.startup_phase("database"):
+        db.init_db()
+        restore_state()
+    os.makedirs("temp", exist_ok=True)  # yt-dlp's default outtmpl
+    with metrics.startup_phase("mpv"):
+        mpv_proc = mpv_start()
+        mpv.start()
+    with metrics.startup_phase("workers"):
+        download_manager.start()
+        resolver.start()
+        threading.Thread(target=player_loop, name="player", daemon=True).start()
+        threading.Thread(target=autoplay_loop, name="autoplay", daemon=True).start()
+        threading.Thread(target=prewarm_loop, name="prewarm", daemon=True).start()
+        threading.Thread(target=journal_loop, name="journal", daemon=True).start()
+        # The budget may have shrunk since the last run
+        threading.Thread(
+            target=storage_quota.enforce, name="storage-quota", daemon=True
+        ).start()
+        library_scanner.start()
+
+
+# Commands the web tier relays; each returns (JSON body, HTTP status)
+
+
+def make_placeholder(qstr, added_by, title=None):
+    """Queue entry shown while a query resolves"""
+    return {
+        "id": uuid.uuid4().hex[:8],
+        "title": f"🔍 {title}" if title else f"🔍 Searching YouTube: {qstr[:30]}...",
+        "uploader": "Loading...",
+        "duration": 0,
+        "url": None,
+        "added_by": added_by,
+        "added_at": time.time(),
+        "loading": True,
+    }
+
+
+def add(payload):
+    if not isinstance(payload.get("q") or "", str):
+        return {"error": "q must be a string"}, 400
+    if not isinstance(payload.get("by") or "", str):
+        return {"error": "by must be a string"}, 400
+    qstr = (payload.get("q") or "").strip()
+    play_next = payload.get("play_next", False)
+    allow_age_restricted = payload.get("allow_age_restricted", False)
+    added_by = payload.get("by")
+    if not qstr:
+        return {"error": "missing q"}, 400
+
+    # Add placeholder immediately for responsive UI
+    placeholder_item = make_placeholder(qstr, added_by)
+
+    # Identical queries already being resolved share that one extraction
+    try:
+        flight = resolver.submit(
+            normalize_query(qstr, allow_age_restricted),
+            PRIORITY_PLAY_NEXT if play_next else PRIORITY_USER,
+            qstr,
+            allow_age_restricted,
+        )
+    except ResolverBusy:
+        return {"error": "Too many songs being searched, try again shortly"}, 503
+
+    with state_lock:
+        # A copy: the queue updates its entry in place once resolved
+        if play_next:
+            play_queue.play_next(dict(placeholder_item))
+        else:
+            # After the last user-added song, ahead of autoplay
+            play_queue.add_user(dict(placeholder_item))
+        new_head = play_queue.head()["id"] == placeholder_item["id"]
+        bump_state("queue")
+    if new_head:
+        wake_player()  # A new head replaces whatever mpv has preloaded
+
+    # Resolve in the shared pool; the player thread swaps in the result
+    flight.add_done_callback(
+        lambda f: cmd_queue.put(("resolved", placeholder_item["id"], qstr, added_by, f))
+    )
+    return {"ok": True, "item": placeholder_item}, 200
+
+
+batches = {}  # batch id -> progress, oldest first
+batch_lock = threading.Lock()
+
+
+def add_batch(payload):
+    """Queue a playlist URL ({"url"}) or a list of queries ({"queries"})
+
+    Returns at once with the batch id; a playlist is listed flat in the
+    background, then all placeholders are queued in one step, in order.
+    """
+    if not isinstance(payload.get("url") or "", str):
+        return {"error": "url must be a string"}, 400
+    if not isinstance(payload.get("by") or "", str):
+        return {"error": "by must be a string"}, 400
+    url = (payload.get("url") or "").strip()
+    queries = payload.get("queries")
+    if not url and not queries:
+        return {"error": "need url or queries"}, 400
+    if queries is not None and not (
+        isinstance(queries, list) and all(isinstance(q, str) for q in queries)
+    ):
+        return {"error": "queries must be a list of strings"}, 400
+    batch = {
+        "id": uuid.uuid4().hex[:8],
+        "status": "listing" if url else "resolving",
+        "total": 0,
+        "resolved": 0,
+        "failed": 0,
+        "items": [],
+        "version": 0,
+    }
+    with batch_lock:
+        batches[batch["id"]] = batch
+        for old in [key for key, b in batches.items() if b["status"] == "done"][
+            :-BATCHES_KEPT
+        ]:
+            del batches[old]
+    entries = [(q.strip(), None) for q in queries or [] if q.strip()][:BATCH_MAX]
+    args = (batch, payload.get("play_next", False), payload.get("by"))
+    allow_age_restricted = payload.get("allow_age_restricted", False)
+    if url:
+        threading.Thread(
+            target=lambda: run_batch(
+                *args, playlist_entries(url), allow_age_restricted
+            ),
+            name="batch-listing",
+            daemon=True,
+        ).start()
+    else:
+        threading.Thread(
+            target=run_batch,
+            args=(*args, entries, allow_age_restricted),
+            name="batch",
+            daemon=True,
+        ).start()
+    return {"ok": True, "batch": batch_snapshot(batch["id"])}, 200
+
+
+def playlist_entries(url):
+    """(URL, title) per playlist entry, listed flat: no extraction per video"""
+    try:
+        with search_pool.borrow(noplaylist=False, playlistend=BATCH_MAX) as ydl:
+            with metrics.ytdlp_seconds.time(op="playlist"):
+                info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        print(f"❌ Listing playlist failed: {e}")
+        return []
+    entries = info.get("entries")
+    if entries is None:
+        return [(url, info.get("title"))]  # A single video
+    listed = []
+    for entry in list(entries)[:BATCH_MAX]:
+        if entry and (entry.get("url") or entry.get("id")):
+            listed.append((entry.get("url") or entry["id"], entry.get("title")))
+    print(f"📃 Listed {len(listed)} playlist entries: {info.get('title') or url}")
+    return listed
+
+
+def update_batch(batch, index, status, title=None):
+    """Record one item's progress for batch_status, counting finished items"""
+    with batch_lock:
+        item = batch["items"][index]
+        item["status"] = status
+        if title:
+            item["title"] = title
+        if status == "done":
+            batch["resolved"] += 1
+        elif status == "failed":
+            batch["failed"] += 1
+        batch["version"] += 1
+
+
+def run_batch(batch, play_next, added_by, entries, allow_age_restricted):
+    """Queue every entry's placeholder, then resolve a few at a time in order
+
+    The first entry resolves at its normal priority so it starts playing
+    right away; the rest wait behind single adds from other guests.
+    """
+    placeholders = [
+        make_placeholder(query, added_by, title) for query, title in entries
+    ]
+    with batch_lock:
+        batch["items"] = [
+            {"id": item["id"], "query": query, "title": title, "status": "queued"}
+            for item, (query, title) in zip(placeholders, entries)
+        ]
+        batch["total"] = len(entries)
+        batch["status"] = "resolving" if entries else "done"
+        batch["version"] += 1
+    if not entries:
+        return
+
+    with state_lock:
+        # One step, so the batch stays together and in order
+        if play_next:
+            for item in reversed(placeholders):
+                play_queue.play_next(dict(item))
+        else:
+            for item in placeholders:
+                play_queue.add_user(dict(item))
+        new_head = play_queue.head()["id"] == placeholders[0]["id"]
+        bump_state("queue")
+    if new_head:
+        wake_player()
+
+    slots = threading.Semaphore(resolver.workers)  # At most this many in flight
+    done = threading.Semaphore(0)
+    for index, (item, (query, _)) in enumerate(zip(placeholders, entries)):
+        slots.acquire()
+        with state_lock:
+            queued = item["id"] in play_queue
+        if not queued:  # Removed from the queue before its turn
+            update_batch(batch, index, "removed")
+            slots.release()
+            done.release()
+            continue
+        if index == 0:
+            priority = PRIORITY_PLAY_NEXT if play_next else PRIORITY_USER
+        else:
+            priority = PRIORITY_BATCH
+        update_batch(batch, index, "resolving")
+        while True:
+            try:
+                flight = resolver.submit(
+                    normalize_query(query, allow_age_restricted),
+                    priority,
+                    query,
+                    allow_age_restricted,
+                )
+                break
+            except ResolverBusy:
+                time.sleep(1)  # Others' adds fill the backlog; wait our turn
+
+        def on_resolved(f, index=index, item_id=item["id"], query=query):
+            try:
+                meta = f.result()
+            except Exception:
+                meta = None
+            if meta:
+                update_batch(batch, index, "done", meta.get("title"))
+            else:
+                update_batch(batch, index, "failed")
+            cmd_queue.put(("resolved", item_id, query, added_by, f))
+            slots.release()
+            done.release()
+
+        flight.add_done_callback(on_resolved)
+    for _ in entries:
+        done.acquire()
+    with batch_lock:
+        batch["status"] = "done"
+        batch["version"] += 1
+    print(
+        f"📃 Batch {batch['id']}: {batch['resolved']} queued, {batch['failed']} failed"
+    )
+
+
+def batch_snapshot(batch_id):
+    with batch_lock:
+        batch = batches.get(batch_id)
+        if batch is None:
+            return None
+        return {**batch, "items": [dict(item) for item in batch["items"]]}
+
+
+def batch_status(batch_id):
+    snapshot = batch_snapshot(batch_id)
+    if snapshot is None:
+        return {"error": "no such batch"}, 404
+    return snapshot, 200
+
+
+def queue_move(payload):
+    item_id = payload.get("id")
+    to = payload.get("to")
+    if not isinstance(item_id, str) or not item_id or not isinstance(to, int):
+        return {"error": "need id and integer to"}, 400
+    with state_lock:
+        if not play_queue.move(item_id, to):
+            return {"error": "not in queue"}, 404
+        bump_state("queue")
+    wake_player()  # The head (and what mpv preloaded) may have changed
+    return {"ok": True}, 200
+
+
+def queue_remove(payload):
+    ids = payload.get("ids") or [payload.get("id")]
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return {"error": "need id or a list of ids"}, 400
+    with state_lock:
+        removed = [item_id for item_id in ids if play_queue.remove(item_id)]
+        if removed:
+            bump_state("queue")
+    if not removed:
+        return {"error": "not in queue"}, 404
+    wake_player()
+    return {"ok": True, "removed": removed}, 200
+
+
+def queue_clear(payload):
+    """Empty the queue, or with {"autoplay": true} only the suggestions"""
+    with state_lock:
+        removed = play_queue.clear(autoplay_only=bool(payload.get("autoplay")))
+        if removed:
+            bump_state("queue")
+    wake_player()
+    return {"ok": True, "removed": removed}, 200
+
+
+def library_pin(payload):
+    """Pin a downloaded track so the storage quota never evicts it"""
+    video_id = payload.get("id")
+    if not isinstance(video_id, str) or not video_id:
+        return {"error": "missing id"}, 400
+    if not storage_quota.pin(video_id, payload.get("pinned", True)):
+        return {"error": "not in library"}, 404
+    return {"ok": True}, 200
+
+
+def player_command(name):
+    """skip, pause and play are handled by the player thread"""
+
+    def command():
+        cmd_queue.put(name)
+        return {"ok": True}, 200
+
+    return command
+
+
+def seek(payload):
+    try:
+        mpv.seek(float(payload.get("pos", 0)))
+        bump_state("now")
+        return {"ok": True}, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+COMMANDS = {
+    "add": add,
+    "add_batch": add_batch,
+    "batch_status": batch_status,
+    "queue_move": queue_move,
+    "queue_remove": queue_remove,
+    "queue_clear": queue_clear,
+    "skip": player_command("skip"),
+    "pause": player_command("pause"),
+    "play": player_command("play"),
+    "seek": seek,
+    "downloads": lambda: (download_manager.status(), 200),
+    "storage": lambda: (storage_quota.report(), 200),
+    "library_pin": library_pin,
+    "metrics": lambda: (metrics.render(), 200),
+}
+
+
+def serve(path=ENGINE_SOCK):
+    """Accept web workers on a Unix socket, one thread per connection"""
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    print(f"🎛️ Player engine listening on {path}")
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=serve_client, args=(conn,), daemon=True).start()
+
+
+def serve_client(conn):
+    """Run one worker's commands in order; "subscribe" starts state pushes"""
+    send_lock = threading.Lock()
+
+    def send(message):
+        line = message if isinstance(message, str) else json.dumps(message)
+        with send_lock:
+            conn.sendall((line + "\n").encode())
+
+    buf = b""
+    try:
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                return
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    send(run_command(json.loads(line), send))
+    except (OSError, ValueError):
+        pass
+    finally:
+        conn.close()
+
+
+def run_command(msg, send):
+    name, *args = msg.get("command") or [None]
+    reply = {"request_id": msg.get("request_id"), "error": "success"}
+    try:
+        if name == "subscribe":
+            threading.Thread(target=push_state, args=(send,), daemon=True).start()
+        elif name in COMMANDS:
+            reply["data"], reply["status"] = COMMANDS[name](*args)
+        else:
+            reply["error"] = f"unknown command {name}"
+    except Exception as e:
+        print(f"❌ Engine command {name} failed: {e}")
+        reply["error"] = str(e)
+    return reply
+
+
+def push_state(send):
+    """Send a full state event, then one per change, until the worker leaves"""
+    seen = -1
+    while True:
+        if seen >= 0 and wait_for_state(seen, timeout=60) <= seen:
+            continue
+        seen, event = state_event(seen)
+        try:
+            send(event)
+        except OSError:
+            return
+
+
+if __name__ == "__main__":
+    with metrics.startup_phase("engine"):
+        start()
+    serve()
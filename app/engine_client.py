@@ -0,0 +1,226 @@
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+
+# Use Termux path if running on Android, otherwise use /tmp
+ENGINE_SOCK = os.environ.get(
+    "ENGINE_SOCK",
+    "/data/data/com.termux/files/usr/tmp/jukebox-engine.sock"
+    if os.path.exists("/data/data/com.termux")
+    else "/tmp/jukebox-engine.sock",
+)
+SECTIONS = ("now", "queue", "history")
+
+
+class EngineError(Exception):
+    pass
+
+
+class EngineCommandError(EngineError):
+    """The engine is up but the command raised"""
+
+
+class EngineClient:
+    """A web worker's connection to the player engine
+
+    Same framing as mpv's JSON IPC: commands are matched to replies by
+    ``request_id``. The connection also subscribes to "state" events, so
+    every worker keeps its own mirror of now/queue/history and serves
+    /queue and /events from memory. The reader thread is started on first
+    use in each process, so the client survives a pre-forking server.
+    """
+
+    def __init__(self, path=ENGINE_SOCK):
+        self.path = path
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._cond = threading.Condition()  # Guards the mirror below
+        self.epoch = None  # Changes when the engine restarts
+        self.version = -1
+        self._versions = dict.fromkeys(SECTIONS, 0)
+        self._sections = {}  # "queue"/"history" -> serialized JSON
+        self._now = None
+        self._now_at = 0.0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._sock = None
+            self._send_lock = threading.Lock()
+            self._ids = itertools.count(1)
+            self._pending = {}  # request_id -> callback(reply)
+            self._pending_lock = threading.Lock()
+            self._connected = threading.Event()
+            threading.Thread(
+                target=self._run, name="engine-client", daemon=True
+            ).start()
+
+    def command(self, name, *args, timeout=10.0):
+        """Run an engine command; returns (body, HTTP status)"""
+        self._ensure_started()
+        done = threading.Event()
+        result = {}
+
+        def on_reply(reply):
+            result.update(reply)
+            done.set()
+
+        # Give the reader a moment to connect on a worker's first request
+        self._connected.wait(timeout=2)
+        if not self._send([name, *args], on_reply):
+            raise EngineError("engine not running")
+        if not done.wait(timeout):
+            raise EngineError(f"engine timed out on {name}")
+        if result.get("lost"):  # Engine went away (or restarted) mid-command
+            raise EngineError(result["error"])
+        if result.get("error") != "success":
+            raise EngineCommandError(result.get("error", "unknown error"))
+        return result.get("data"), result.get("status", 200)
+
+    def wait_for_state(self, since, timeout, epoch=None):
+        """Block until there is something newer than `since`; True if so
+
+        Versions restart with the engine, so a different epoch counts as
+        newer too.
+        """
+        self._ensure_started()
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.epoch is not None
+                and (self.version > since or self.epoch != epoch),
+                timeout,
+            )
+
+    def state_payload(self, since=-1, epoch=None):
+        """(epoch, version, JSON) with the sections changed after `since`
+
+        `since` only counts for the engine run it came from (`epoch`, if
+        given); otherwise every section is included.
+        """
+        self._ensure_started()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.epoch is not None, timeout=5):
+                raise EngineError("no state from the engine yet")
+            if epoch is not None and epoch != self.epoch:
+                since = -1
+            parts = [f'"version": {self.version}']
+            for section in ("queue", "history"):
+                if self._versions[section] > since:
+                    parts.append(f'"{section}": {self._sections[section]}')
+            if since < 0 or self._versions["now"] > since:
+                parts.append(f'"now": {json.dumps(self._now_playing())}')
+            return self.epoch, self.version, "{" + ", ".join(parts) + "}"
+
+    def now_playing(self):
+        """The current track with its position as of this moment, or None"""
+        self._ensure_started()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.epoch is not None, timeout=5):
+                raise EngineError("no state from the engine yet")
+            return self._now_playing()
+
+    def _now_playing(self):
+        now = self._now
+        if now and "position" in now and not now.get("paused"):
+            # Playing on since the engine reported it
+            now = dict(now)
+            now["position"] = round(
+                now["position"] + time.monotonic() - self._now_at, 1
+            )
+        return now
+
+    def parse_since(self, tag):
+        """Turn an ETag / Last-Event-ID of the form epoch-version into a version"""
+        epoch, _, version = (tag or "").strip('"').partition("-")
+        if epoch != self.epoch or not version.isdigit():
+            return -1
+        return int(version)
+
+    def _send(self, command, callback):
+        request_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[request_id] = callback
+        line = json.dumps({"command": command, "request_id": request_id}) + "\n"
+        try:
+            with self._send_lock:
+                if self._sock is None:
+                    raise OSError("engine not connected")
+                self._sock.sendall(line.encode())
+            return True
+        except OSError:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            return False
+
+    def _run(self):
+        backoff = 0.1
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            backoff = 0.1
+            with self._send_lock:
+                self._sock = sock
+            self._send(["subscribe"], lambda reply: None)
+            self._connected.set()
+            try:
+                self._read(sock)
+            except OSError:
+                pass
+            self._connected.clear()
+            with self._send_lock:
+                self._sock = None
+            sock.close()
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for callback in pending.values():
+                callback({"error": "engine connection lost", "lost": True})
+            print("⚠️ Lost player engine connection, reconnecting")
+
+    def _read(self, sock):
+        buf = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                if msg.get("event") == "state":
+                    self._apply_state(msg)
+                    continue
+                with self._pending_lock:
+                    callback = self._pending.pop(msg.get("request_id"), None)
+                if callback:
+                    callback(msg)
+
+    def _apply_state(self, msg):
+        with self._cond:
+            self.epoch = msg["epoch"]
+            self.version = msg["version"]
+            self._versions = msg["versions"]
+            for section in ("queue", "history"):
+                if section in msg:
+                    self._sections[section] = json.dumps(msg[section])
+            if "now" in msg:
+                self._now = msg["now"]
+                self._now_at = time.monotonic()
+            self._cond.notify_all()
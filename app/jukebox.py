@@ -1,676 +1,396 @@
-import glob
+"""Web tier: a stateless Flask app in front of the player engine
+
+Every route relays to the engine process (engine.py) over its Unix socket,
+so any number of WSGI workers can serve the same jukebox:
+
+    python engine.py &
+    gunicorn -w 4 --threads 16 jukebox:app
+
+`python jukebox.py` runs both in one process, as on the phone: the web
+server starts accepting requests first and the engine comes up beside it.
+
+Audio streams, event streams and long-polls hold a worker thread for as
+long as they stay open, so at most STREAM_MAX_LISTENERS and
+EVENTS_MAX_SUBSCRIBERS of them run per worker; keep their sum well below
+--threads. With an async worker class (gunicorn -k gevent) they cost no
+thread and both caps can be raised.
+"""
+
+import io
 import json
 import os
-import queue as q
-import random
 import socket
-import sqlite3
-import subprocess
 import threading
 import time
-import traceback
-import uuid
-
-import requests
-import yt_dlp
-from flask import Flask, jsonify, request, send_from_directory
 
-HOST = "0.0.0.0"
-PORT = int(os.environ.get("PORT", "5000"))
-# Use Termux path if running on Android, otherwise use /tmp
-default_sock = (
-    "/data/data/com.termux/files/usr/tmp/mpv.sock"
-    if os.path.exists("/data/data/com.termux")
-    else "/tmp/mpv.sock"
-)
-IPC_SOCK = os.environ.get("MPV_IPC", default_sock)
-MPV_EXTRA = (
-    os.environ.get("MPV_EXTRA", "").split() if os.environ.get("MPV_EXTRA") else []
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    jsonify,
+    request,
+    send_from_directory,
+    url_for,
 )
-LASTFM_API_KEY = os.environ.get("LASTFM_API_KEY")
-
-app = Flask(__name__)
-play_queue = []
-current = None
-played_history = []  # Track played songs in current session
-state_lock = threading.Lock()
-cmd_queue = q.Queue()
-suggested_songs = set()  # Track already suggested songs
-
-
-def mpv_start():
-    if os.path.exists(IPC_SOCK):
-        os.remove(IPC_SOCK)
-    args = [
-        "mpv",
-        "--no-video",
-        "--terminal=no",
-        "--idle=yes",
-        f"--input-ipc-server={IPC_SOCK}",
-        "--volume=100",
-        "--ytdl=no",
-    ] + MPV_EXTRA
-    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-
-mpv = mpv_start()
-
-
-def init_db():
-    db_dir = "/app/data" if os.path.exists("/app") else "data"
-    os.makedirs(db_dir, exist_ok=True)
-    conn = sqlite3.connect(f"{db_dir}/music.db")
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS downloads (
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            uploader TEXT,
-            duration INTEGER,
-            url TEXT,
-            filepath TEXT,
-            downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    conn.close()
-
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
 
-init_db()
+from engine_client import ENGINE_SOCK, EngineClient, EngineCommandError, EngineError
+import library
+import metrics
 
-
-def mpv_send(cmd):
-    for _ in range(3):
-        try:
-            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            s.connect(IPC_SOCK)
-            s.sendall((json.dumps(cmd) + "\n").encode())
-            s.close()
-            return True
-        except Exception:
-            time.sleep(0.2)
-    return False
-
-
-def resolve_media(q_or_url, allow_age_restricted=False):
-    music_dir = os.path.expanduser(
-        "~/storage/music"
-    )  # Use lowercase symlink to Android Music
-    # Create temp directory for search metadata
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-    ydl_opts = {
-        "format": "bestaudio[acodec*=opus]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best",
-        "quiet": True,
-        "no_warnings": True,
-        "socket_timeout": 20,
-        "retries": 1,
-        "noplaylist": True,
-        "default_search": "ytsearch5:",  # Fewer results for faster search
-        "writeinfojson": True,
-        "writethumbnail": True,
-        "embedthumbnail": True,
-        "outtmpl": {
-            "default": "temp/search_%(title)s.%(ext)s",
-            "infojson": "temp/search_%(title)s.%(ext)s",
-            "thumbnail": "temp/search_%(title)s.%(ext)s",
-        },
-    }
-
-    # Add cookies if available (check multiple locations)
-    cookie_paths = [
-        "cookies.txt",  # Current directory
-        os.path.expanduser("~/cookies.txt"),  # Home directory
-        "/data/data/com.termux/files/home/cookies.txt",  # Termux home
-        os.path.expanduser("~/storage/downloads/cookies.txt"),  # Android downloads
-    ]
-
-    for cookie_path in cookie_paths:
-        if os.path.exists(cookie_path):
-            ydl_opts["cookiefile"] = cookie_path
-            print(f"🍪 Using cookies from: {cookie_path}")
-            break
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            info = ydl.extract_info(q_or_url, download=False)
-            if "entries" in info:
-                # Filter for music: duration 1-10 minutes, music-related titles
-                music_entries = []
-                for entry in info["entries"]:
-                    duration = entry.get("duration", 0)
-                    title = entry.get("title", "").lower()
-                    uploader = entry.get("uploader", "").lower()
-
-                    # Skip age-restricted content unless allowed
-                    if (
-                        not allow_age_restricted
-                        and entry.get("age_limit")
-                        and entry.get("age_limit") > 0
-                    ):
-                        continue
-
-                    # Skip if too long (>20 min) or too short (<30 sec)
-                    if duration and (duration > 1200 or duration < 30):
-                        continue
-
-                    # Prefer music-related content
-                    music_keywords = [
-                        "official",
-                        "music",
-                        "audio",
-                        "song",
-                        "album",
-                        "single",
-                    ]
-                    avoid_keywords = [
-                        "podcast",
-                        "interview",
-                        "live stream",
-                        "tutorial",
-                        "review",
-                    ]
-
-                    has_music_keyword = any(
-                        keyword in title or keyword in uploader
-                        for keyword in music_keywords
-                    )
-                    has_avoid_keyword = any(
-                        keyword in title or keyword in uploader
-                        for keyword in avoid_keywords
-                    )
-
-                    if has_avoid_keyword:
-                        continue
-
-                    music_entries.append((entry, has_music_keyword))
-
-                if music_entries:
-                    # Sort by music preference (music keywords first)
-                    music_entries.sort(key=lambda x: x[1], reverse=True)
-                    info = music_entries[0][0]
-                else:
-                    # Fallback to first entry if no good matches
-                    info = info["entries"][0]
-
-            video_id = info.get("id")
-            title = info.get("title") or "Unknown"
-            artist = (
-                info.get("artist")
-                or info.get("uploader")
-                or info.get("channel")
-                or "Unknown"
-            )
-            album = info.get("album") or "Unknown Album"
-            release_year = info.get("release_year") or "Unknown"
-            duration = info.get("duration") or 0
-
-            # Create organized path: Artist/Year Album/
-            if (
-                artist != "Unknown"
-                and release_year != "Unknown"
-                and album != "Unknown Album"
-            ):
-                target_dir = f"{music_dir}/{artist}/{release_year} {album}"
-            else:
-                target_dir = f"{music_dir}/{artist}"
-
-            # Check if already downloaded
-            db_dir = "/app/data" if os.path.exists("/app") else "data"
-            try:
-                conn = sqlite3.connect(f"{db_dir}/music.db")
-                existing = conn.execute(
-                    "SELECT filepath FROM downloads WHERE title = ? AND uploader = ?",
-                    (title, artist),
-                ).fetchone()
-                conn.close()
-
-                if existing and os.path.exists(existing[0]):
-                    print(f"⏭ Playing {title} by {artist} from local file")
-                    return {
-                        "title": title,
-                        "uploader": artist,
-                        "duration": duration,
-                        "url": existing[0],
-                    }
-            except Exception:
-                pass
-
-            # Start download in background
-            def download_bg():
-                try:
-                    os.makedirs(target_dir, exist_ok=True)
-
-                    # Download with organized structure
-                    download_opts = ydl_opts.copy()
-                    # Ensure metadata directory exists
-                    metadata_dir = f"{target_dir}/metadata"
-                    os.makedirs(metadata_dir, exist_ok=True)
-
-                    # Enable metadata only for actual downloads
-                    download_opts["writeinfojson"] = True
-                    download_opts["writethumbnail"] = True
-                    download_opts["embedthumbnail"] = True
-
-                    # Add cookies for downloads too
-                    for cookie_path in cookie_paths:
-                        if os.path.exists(cookie_path):
-                            download_opts["cookiefile"] = cookie_path
-                            break
-
-                    download_opts["outtmpl"] = {
-                        "default": f"{target_dir}/{artist} - {title}.%(ext)s",
-                        "infojson": f"{metadata_dir}/{artist} - {title}.%(ext)s",
-                        "thumbnail": f"{metadata_dir}/{artist} - {title}.%(ext)s",
-                    }
-
-                    with yt_dlp.YoutubeDL(download_opts) as download_ydl:
-                        download_ydl.download([info["webpage_url"]])
-
-                    # Find the downloaded file
-                    audio_files = glob.glob(f"{target_dir}/{artist} - {title}.*")
-                    audio_files = [
-                        f
-                        for f in audio_files
-                        if not f.endswith(".json") and not f.endswith(".jpg")
-                    ]
-
-                    if audio_files:
-                        filepath = audio_files[0]
-
-                        # Save to database
-                        db_dir = "/app/data" if os.path.exists("/app") else "data"
-                        conn = sqlite3.connect(f"{db_dir}/music.db")
-                        conn.execute(
-                            "INSERT OR REPLACE INTO downloads (id, title, uploader, duration, url, filepath) VALUES (?, ?, ?, ?, ?, ?)",
-                            (
-                                video_id,
-                                title,
-                                artist,
-                                duration,
-                                info["webpage_url"],
-                                filepath,
-                            ),
-                        )
-                        conn.commit()
-                        conn.close()
-                        print(f"✓ Downloaded: {artist} - {title}")
-
-                except Exception as e:
-                    print(f"Download failed: {e}")
-
-            threading.Thread(target=download_bg, daemon=True).start()
-
-            return {
-                "title": title,
-                "uploader": artist,
-                "duration": duration,
-                "url": info.get("url"),
-            }
-
-        except Exception as e:
-            print(f"yt-dlp failed: {e}")
-            return None
-
-
-def get_lastfm_recommendations(artist, track=None):
-    """Get recommendations from Last.fm API"""
-    if not LASTFM_API_KEY:
-        return []
+HOST = "0.0.0.0"
+PORT = int(os.environ.get("PORT", "5000"))
+# Per web worker, and a share of its threads (--threads); listeners beyond
+# this get a 503 so /queue and /add keep threads to run on
+STREAM_MAX_LISTENERS = int(os.environ.get("STREAM_MAX_LISTENERS", "4"))
+# Likewise for open /events streams, batch progress streams and /queue
+# long-polls; browsers turned away fall back to plain polling
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get("EVENTS_MAX_SUBSCRIBERS", "8"))
+BATCH_POLL_INTERVAL = 0.5  # Seconds between progress checks on a batch stream
+STREAM_MAX_AGE = 86400  # A downloaded file never changes under its path
+AUDIO_TYPES = {
+    ".aac": "audio/aac",
+    ".flac": "audio/flac",
+    ".m4a": "audio/mp4",
+    ".mp3": "audio/mpeg",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".wav": "audio/wav",
+    ".webm": "audio/webm",  # Audio-only; mimetypes would say video/webm
+}
+
+routes = Blueprint("jukebox", __name__)
+engine = EngineClient(ENGINE_SOCK)
+listeners = threading.BoundedSemaphore(STREAM_MAX_LISTENERS)
+subscribers = threading.BoundedSemaphore(EVENTS_MAX_SUBSCRIBERS)
+
+
+def relay(command, *args):
+    """Run an engine command and answer with its body and status"""
     try:
-        if track:
-            # Get similar tracks
-            url = f"http://ws.audioscrobbler.com/2.0/?method=track.getsimilar&artist={artist}&track={track}&api_key={LASTFM_API_KEY}&format=json&limit=10"
-            response = requests.get(url, timeout=5)
-            data = response.json()
-            if "similartracks" in data and "track" in data["similartracks"]:
-                tracks = data["similartracks"]["track"]
-                return [f"{t['artist']['name']} {t['name']}" for t in tracks[:5]]
-
-        # Fallback to similar artists
-        url = f"http://ws.audioscrobbler.com/2.0/?method=artist.getsimilar&artist={artist}&api_key={LASTFM_API_KEY}&format=json&limit=10"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        if "similarartists" in data and "artist" in data["similarartists"]:
-            artists = data["similarartists"]["artist"]
-            return [f"{a['name']} songs" for a in artists[:5]]
-    except Exception as e:
-        print(f"Last.fm API failed: {e}")
-    return []
+        body, status = engine.command(command, *args)
+    except EngineCommandError as e:
+        return jsonify(error=f"Player engine failed: {e}"), 500
+    except EngineError as e:
+        return jsonify(error=f"Player engine unavailable: {e}"), 503
+    return jsonify(body), status
 
 
-def fill_autoplay_queue():
-    """Fill queue with 3 autoplay suggestions using Last.fm (only if within same session)"""
-    try:
-        db_dir = "/app/data" if os.path.exists("/app") else "data"
-        conn = sqlite3.connect(f"{db_dir}/music.db")
-
-        # Check if we're in the same session (last song < 3 hours ago)
-        last_song_time = conn.execute(
-            "SELECT downloaded_at FROM downloads ORDER BY downloaded_at DESC LIMIT 1"
-        ).fetchone()
-
-        if not last_song_time:
-            print("🎵 No listening history - skipping autoplay suggestions")
-            conn.close()
-            return
-
-        # Check if last song was more than 3 hours ago
-        import datetime
-
-        last_time = datetime.datetime.fromisoformat(last_song_time[0])
-        now = datetime.datetime.now()
-        hours_since = (now - last_time).total_seconds() / 3600
-
-        if hours_since > 3:
-            print(
-                f"🎵 New session detected ({hours_since:.1f}h since last song) - skipping autoplay"
-            )
-            suggested_songs.clear()  # Clear suggestions for new session
-            conn.close()
-            return
-
-        recent_songs = conn.execute(
-            "SELECT title, uploader FROM downloads ORDER BY downloaded_at DESC LIMIT 5"
-        ).fetchall()
-
-        # Get all songs played in last 3 hours to avoid repeating
-        played_recently = conn.execute(
-            "SELECT title, uploader FROM downloads WHERE downloaded_at > datetime('now', '-3 hours')"
-        ).fetchall()
-        played_set = {f"{title}-{artist}" for title, artist in played_recently}
-
-        conn.close()
-
-        print(f"🎵 Same session ({hours_since:.1f}h ago) - adding autoplay suggestions")
-
-        search_options = []
-
-        # Get Last.fm recommendations based on recent songs
-        for title, artist in recent_songs[:3]:  # Use last 3 songs
-            recommendations = get_lastfm_recommendations(artist, title)
-            search_options.extend(recommendations)
-
-        # Add some variety
-        search_options.extend(
-            [
-                f"{recent_songs[0][1]} top songs",  # Latest artist's top songs
-                f"trending music {__import__('datetime').datetime.now().year}",
-            ]
-        )
+def too_busy(what):
+    """503 for a request that would hold a thread the worker can't spare"""
+    response = jsonify(error=f"too many {what}, try again shortly")
+    response.headers["Retry-After"] = "5"
+    return response, 503
 
-        # Remove duplicates and shuffle
-        search_options = list(set(search_options))
-        random.shuffle(search_options)
 
-        added_count = 0
-        for search_query in search_options:
-            if added_count >= 3:
-                break
-            try:
-                autoplay_meta = resolve_media(search_query)
-                if autoplay_meta:
-                    song_id = f"{autoplay_meta['title']}-{autoplay_meta['uploader']}"
-
-                    # Skip if already suggested, in current queue, or played recently
-                    if (
-                        song_id in suggested_songs
-                        or song_id in played_set
-                        or any(
-                            item.get("title") == autoplay_meta["title"]
-                            and item.get("uploader") == autoplay_meta["uploader"]
-                            for item in play_queue
-                        )
-                    ):
-                        print(f"🔄 Skipping duplicate/recent: {autoplay_meta['title']}")
-                        continue
-
-                    autoplay_item = {
-                        "id": uuid.uuid4().hex[:8],
-                        **autoplay_meta,
-                        "added_by": "autoplay",
-                    }
-                    play_queue.append(autoplay_item)
-                    suggested_songs.add(song_id)
-                    added_count += 1
-                    print(
-                        f"🎵 Added via Last.fm ({search_query}): {autoplay_item['title']}"
-                    )
-            except Exception as e:
-                print(f"Autoplay failed for {search_query}: {e}")
-    except Exception as e:
-        print(f"Fill autoplay queue failed: {e}")
-
-
-def player_loop():
-    global current
-    while True:
-        with state_lock:
-            # Keep queue filled with 3 songs
-            if len(play_queue) < 3:
-                fill_autoplay_queue()
-
-            if current is None and play_queue:
-                next_song = play_queue[0]
-                # Skip loading placeholders, wait for them to resolve
-                if not next_song.get("loading", False) and next_song.get("url"):
-                    current = play_queue.pop(0)
-                    mpv_send({"command": ["loadfile", current["url"], "replace"]})
-        # Keep queue filled
-        with state_lock:
-            if len(play_queue) < 3:
-                fill_autoplay_queue()
+def json_body():
+    """The request's JSON object, or {} when it's missing or not an object"""
+    payload = request.get_json(silent=True)
+    return payload if isinstance(payload, dict) else {}
 
-        try:
-            cmd = cmd_queue.get(timeout=0.3)
-            if cmd == "skip":
-                mpv_send({"command": ["stop"]})  # goes idle
-                with state_lock:
-                    current = None
-            elif cmd == "pause":
-                mpv_send({"command": ["set_property", "pause", True]})
-            elif cmd == "play":
-                mpv_send({"command": ["set_property", "pause", False]})
-        except q.Empty:
-            pass
-        # detect idle => track ended
-        try:
-            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            s.connect(IPC_SOCK)
-            s.sendall(
-                (
-                    json.dumps({"command": ["get_property", "idle-active"]}) + "\n"
-                ).encode()
-            )
-            data = s.recv(2048).decode()
-            s.close()
-            if '"data":true' in data:
-                with state_lock:
-                    if current:  # Add finished song to history
-                        played_history.append(current)
-                        # Keep only last 20 songs in history
-                        if len(played_history) > 20:
-                            played_history.pop(0)
-                    current = None
-        except Exception:
-            pass
-        time.sleep(0.2)
-
-
-threading.Thread(target=player_loop, daemon=True).start()
-
-
-@app.get("/")
+
+@routes.get("/")
 def landing():
     return send_from_directory(".", "landing.html")
 
-@app.get("/app")
+
+@routes.get("/app")
 def ui():
     return send_from_directory(".", "jukebox.html")
 
-@app.get("/static/<path:filename>")
+
+@routes.get("/static/<path:filename>")
 def static_files(filename):
     return send_from_directory("static", filename)
 
 
-@app.get("/queue")
+@routes.get("/queue")
 def get_queue():
     try:
-        with state_lock:
-            now_with_progress = current.copy() if current else None
-            if now_with_progress:
-                try:
-                    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                    s.connect(IPC_SOCK)
-                    # Get both position and pause state
-                    s.sendall(
-                        (
-                            json.dumps({"command": ["get_property", "time-pos"]}) + "\n"
-                        ).encode()
-                    )
-                    data = s.recv(2048).decode()
-                    if '"data":' in data:
-                        pos = json.loads(data).get("data", 0) or 0
-                        now_with_progress["position"] = int(pos)
-
-                    # Get pause state
-                    s.sendall(
-                        (
-                            json.dumps({"command": ["get_property", "pause"]}) + "\n"
-                        ).encode()
-                    )
-                    pause_data = s.recv(2048).decode()
-                    if '"data":' in pause_data:
-                        is_paused = json.loads(pause_data).get("data", False)
-                        now_with_progress["paused"] = is_paused
-                    s.close()
-                except Exception:
-                    now_with_progress["position"] = 0
-                    now_with_progress["paused"] = False
-
-            response_data = {"now": now_with_progress, "queue": play_queue, "history": played_history}
-            response = jsonify(response_data)
-            response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-            response.headers["Pragma"] = "no-cache"
-            response.headers["Expires"] = "0"
-            return response
+        # Long-poll: /queue?since=<version> waits for something newer
+        since = request.args.get("since", type=int)
+        if since is not None:
+            if not subscribers.acquire(blocking=False):
+                return too_busy("open connections")
+            try:
+                engine.wait_for_state(since, timeout=25, epoch=engine.epoch)
+            finally:
+                subscribers.release()
+
+        epoch, version, body = engine.state_payload()
+        etag = f"{epoch}-{version}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        # Revalidate every time, the ETag makes unchanged polls cheap
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     except Exception as e:
         print(f"❌ Queue endpoint error: {e}")
         return jsonify({"now": None, "queue": []}), 500
 
 
-@app.post("/add")
+@routes.get("/events")
+def events():
+    """Server-Sent Events stream of state changes
+
+    The first message carries the full state (or a diff against the
+    Last-Event-ID after a reconnect); later ones only the changed sections.
+    """
+    since = engine.parse_since(request.headers.get("Last-Event-ID"))
+    epoch = engine.epoch if since >= 0 else None
+
+    def stream():
+        seen, seen_epoch = since, epoch
+        yield "retry: 2000\n\n"
+        while True:
+            if not engine.wait_for_state(seen, timeout=15, epoch=seen_epoch):
+                yield ": keepalive\n\n"
+                continue
+            seen_epoch, seen, body = engine.state_payload(seen, seen_epoch)
+            yield f"id: {seen_epoch}-{seen}\nevent: state\ndata: {body}\n\n"
+
+    if not subscribers.acquire(blocking=False):
+        return too_busy("open connections")
+    response = Response(stream(), mimetype="text/event-stream")
+    response.call_on_close(subscribers.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@routes.post("/add")
 def add():
-    payload = request.get_json(silent=True) or {}
-    qstr = payload.get("q") or request.args.get("q", "").strip()
-    play_next = payload.get("play_next", False)
-    allow_age_restricted = payload.get("allow_age_restricted", False)
-    added_by = payload.get("by") or request.remote_addr
-    if not qstr:
-        return jsonify(error="missing q"), 400
-
-    # Add placeholder immediately for responsive UI
-    placeholder_item = {
-        "id": uuid.uuid4().hex[:8],
-        "title": f"🔍 Searching YouTube: {qstr[:30]}...",
-        "uploader": "Loading...",
-        "duration": 0,
-        "url": None,
-        "added_by": added_by,
-        "loading": True,
-    }
-
-    with state_lock:
-        if play_next:
-            play_queue.insert(0, placeholder_item)
-            insert_pos = 0
-        else:
-            # Find last user-added song and insert after it
-            insert_pos = len(play_queue)  # Default to end
-            for i in range(len(play_queue) - 1, -1, -1):  # Search backwards
-                if play_queue[i].get("added_by") != "autoplay":
-                    insert_pos = i + 1
-                    break
-                elif i == 0:  # All songs are autoplay
-                    insert_pos = 0
-            play_queue.insert(insert_pos, placeholder_item)
-
-    # Resolve media in background and update placeholder
-    def resolve_and_update():
-        global current
-        try:
-            print(f"🔍 Resolving: {qstr}")
-            meta = resolve_media(qstr, allow_age_restricted)
-            if meta:
-                with state_lock:
-                    # Find and update the placeholder
-                    for i, item in enumerate(play_queue):
-                        if item["id"] == placeholder_item["id"]:
-                            play_queue[i] = {
-                                "id": placeholder_item["id"],
-                                **meta,
-                                "added_by": added_by,
-                            }
-                            # If this was first in queue and nothing is playing, start it
-                            if i == 0 and current is None:
-                                current = play_queue.pop(0)
-                                mpv_send(
-                                    {"command": ["loadfile", current["url"], "replace"]}
-                                )
-                                print(f"▶️ Started playing: {current['title']}")
-                            break
-                print(f"✅ Resolved: {meta['title']}")
-            else:
-                # Remove placeholder if resolution failed
-                with state_lock:
-                    play_queue[:] = [
-                        item
-                        for item in play_queue
-                        if item["id"] != placeholder_item["id"]
-                    ]
-                print(f"❌ Failed to resolve: {qstr}")
-        except Exception as e:
-            # Remove placeholder on error
-            with state_lock:
-                play_queue[:] = [
-                    item for item in play_queue if item["id"] != placeholder_item["id"]
-                ]
-            print(f"❌ Add failed for {qstr}: {e}")
-            print(f"❌ Full traceback: {traceback.format_exc()}")
-            # Also log to file
-            with open("error.log", "a") as f:
-                f.write(f"Error resolving {qstr}: {e}\n{traceback.format_exc()}\n\n")
-
-    threading.Thread(target=resolve_and_update, daemon=True).start()
-    return jsonify(ok=True, item=placeholder_item)
-
-
-@app.post("/skip")
+    payload = json_body()
+    payload["q"] = payload.get("q") or request.args.get("q", "").strip()
+    payload["by"] = payload.get("by") or request.remote_addr
+    return relay("add", payload)
+
+
+@routes.post("/add/batch")
+def add_batch():
+    """{"url": playlist} or {"queries": [...]}: queue many songs at once"""
+    payload = json_body()
+    payload["by"] = payload.get("by") or request.remote_addr
+    return relay("add_batch", payload)
+
+
+@routes.get("/add/batch/<batch_id>")
+def batch_status(batch_id):
+    return relay("batch_status", batch_id)
+
+
+@routes.get("/add/batch/<batch_id>/events")
+def batch_events(batch_id):
+    """Server-Sent Events stream of a batch's progress, ending when it's done"""
+
+    def stream():
+        seen = None
+        while True:
+            try:
+                body, status = engine.command("batch_status", batch_id)
+            except EngineError as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                return
+            if status != 200:
+                yield f"event: error\ndata: {json.dumps(body)}\n\n"
+                return
+            if body["version"] != seen:
+                seen = body["version"]
+                event = "done" if body["status"] == "done" else "progress"
+                yield f"event: {event}\ndata: {json.dumps(body)}\n\n"
+            if body["status"] == "done":
+                return
+            time.sleep(BATCH_POLL_INTERVAL)
+
+    if not subscribers.acquire(blocking=False):
+        return too_busy("open connections")
+    response = Response(stream(), mimetype="text/event-stream")
+    response.call_on_close(subscribers.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@routes.post("/queue/move")
+def queue_move():
+    return relay("queue_move", json_body())
+
+
+@routes.post("/queue/remove")
+def queue_remove():
+    return relay("queue_remove", json_body())
+
+
+@routes.post("/queue/clear")
+def queue_clear():
+    """Empty the queue, or with {"autoplay": true} only the suggestions"""
+    return relay("queue_clear", json_body())
+
+
+@routes.get("/downloads")
+def downloads_status():
+    """Download backlog, running jobs and recent throughput"""
+    return relay("downloads")
+
+
+@routes.get("/storage")
+def storage_report():
+    """Library disk budget, bytes used and bytes reclaimed by eviction"""
+    return relay("storage")
+
+
+@routes.post("/library/pin")
+def library_pin():
+    """{"id": video id, "pinned": bool}: keep a track through evictions"""
+    return relay("library_pin", json_body())
+
+
+@routes.get("/metrics")
+def metrics_endpoint():
+    """The engine's metrics in Prometheus text format"""
+    try:
+        text, _ = engine.command("metrics")
+    except EngineError as e:
+        return Response(f"# engine unavailable: {e}\n", status=503)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+@routes.get("/library/search")
+def library_search():
+    """Instant local results for the search box; no engine or yt-dlp involved"""
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 20, type=int), 50))
+    return jsonify({"results": library.search(query, limit)})
+
+
+class ListenerFile(io.FileIO):
+    """An open audio file holding one of the `listeners` slots until closed"""
+
+    def close(self):
+        if not self.closed:
+            listeners.release()
+        super().close()
+
+
+@routes.get("/stream/<video_id>")
+def stream(video_id):
+    """A downloaded track's audio, with Range requests and conditional GETs
+
+    The open file goes to the WSGI server's file wrapper (sendfile under
+    gunicorn), so no file is ever read into Python memory. The listener
+    slot is freed when the server closes the file after the last byte.
+    """
+    track = library.by_video_id(video_id)
+    if not track:
+        return jsonify(error="not downloaded"), 404
+    if not listeners.acquire(blocking=False):
+        return too_busy("listeners")
+    path = track["url"]
+    try:
+        stat = os.stat(path)
+        file = ListenerFile(path)
+    except OSError:
+        listeners.release()
+        return jsonify(error="not downloaded"), 404
+    response = Response(
+        wrap_file(request.environ, file),
+        mimetype=AUDIO_TYPES.get(os.path.splitext(path)[1].lower()),
+        direct_passthrough=True,
+    )
+    response.content_length = stat.st_size
+    response.last_modified = stat.st_mtime
+    response.set_etag(f"{video_id}-{stat.st_mtime_ns}-{stat.st_size}")
+    response.cache_control.public = True
+    response.cache_control.max_age = STREAM_MAX_AGE
+    try:
+        response = response.make_conditional(
+            request, accept_ranges=True, complete_length=stat.st_size
+        )
+    except RequestedRangeNotSatisfiable:
+        file.close()
+        raise
+    if response.status_code == 304:
+        file.close()  # No body will be sent
+    return response
+
+
+@routes.get("/party")
+def party():
+    """What's playing and where, for browsers that play along ("follow the party")"""
+    try:
+        now = engine.now_playing()
+    except EngineError as e:
+        return jsonify(error=f"Player engine unavailable: {e}"), 503
+    if not now:
+        return jsonify(playing=False, server_time=time.time())
+    local = library.by_video_id(now.get("video_id"))
+    return jsonify(
+        playing=True,
+        video_id=now.get("video_id"),
+        title=now.get("title"),
+        uploader=now.get("uploader"),
+        duration=now.get("duration"),
+        position=now.get("position", 0),
+        paused=bool(now.get("paused")),
+        # Only downloaded tracks can be streamed; the rest play on the phone only
+        stream=url_for(".stream", video_id=now["video_id"]) if local else None,
+        server_time=time.time(),
+    )
+
+
+@routes.post("/skip")
 def skip():
-    cmd_queue.put("skip")
-    return jsonify(ok=True)
+    return relay("skip")
 
 
-@app.post("/pause")
+@routes.post("/pause")
 def pause():
-    cmd_queue.put("pause")
-    return jsonify(ok=True)
+    return relay("pause")
 
 
-@app.post("/play")
+@routes.post("/play")
 def play_cmd():
-    cmd_queue.put("play")
-    return jsonify(ok=True)
+    return relay("play")
 
 
-@app.post("/seek")
+@routes.post("/seek")
 def seek():
-    payload = request.get_json(silent=True) or {}
-    pos = payload.get("pos", 0)
-    try:
-        mpv_send({"command": ["set_property", "time-pos", float(pos)]})
-        return jsonify(ok=True)
-    except Exception as e:
-        return jsonify(error=str(e)), 500
+    return relay("seek", json_body())
+
+
+def create_app():
+    """The web tier; cheap to build, it touches neither mpv nor yt-dlp"""
+    app = Flask(__name__)
+    app.register_blueprint(routes)
+    return app
+
+
+app = create_app()
+
+
+def engine_running():
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(ENGINE_SOCK)
+            return True
+        except OSError:
+            return False
+
+
+def start_engine():
+    """Run the player engine in this process unless one is already up"""
+    if engine_running():
+        print(f"🎛️ Using the player engine at {ENGINE_SOCK}")
+        return
+    with metrics.startup_phase("engine"):
+        import engine as player_engine
+
+        player_engine.start()
+    player_engine.serve(ENGINE_SOCK)
 
 
 def get_local_ip():
@@ -704,6 +424,8 @@ def get_local_ip():
 
 
 if __name__ == "__main__":
+    # Pages are served while mpv, the database and yt-dlp come up
+    threading.Thread(target=start_engine, name="engine", daemon=True).start()
     local_ip = get_local_ip()
     print("\n" + "=" * 50)
     print("🎵 Wi-Fi Jukebox Started!")
@@ -713,4 +435,7 @@ if __name__ == "__main__":
     print("\n📋 Share this URL with others on your WiFi:")
     print(f"   http://{local_ip}:{PORT}")
     print("=" * 50 + "\n")
+    uptime = metrics.process_uptime()
+    if uptime is not None:
+        print(f"⏱️ Startup: serving {uptime * 1000:.0f} ms after launch")
     app.run(host=HOST, port=PORT)
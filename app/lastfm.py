@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import metrics
+
+API_URL = "http://ws.audioscrobbler.com/2.0/"
+NOT_FOUND = 6  # Last.fm error for an unknown track or artist: a real answer
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class LastFmClient:
+    """Last.fm similar-track/artist lookups with keep-alive and a SQLite cache
+
+    Responses (including "not found" answers) are cached per artist/track
+    for `ttl` seconds in the lastfm_cache table, so the same artists in a
+    later session cost no network calls. Requests go through one shared
+    Session and a client-side rate limiter (Last.fm allows ~5 req/s).
+    """
+
+    def __init__(self, api_key, ttl=7 * 86400, rate=5, workers=4, api_url=API_URL):
+        self.api_key = api_key
+        self.ttl = ttl
+        self.api_url = api_url
+        self._limiter = RateLimiter(rate)
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="lastfm"
+        )
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        """The shared keep-alive Session; requests is imported on first use"""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def _call(self, method, **params):
+        """Cached API call; returns the decoded JSON or None on failure"""
+        key = "|".join(
+            [method]
+            + [
+                f"{name}={(value or '').strip().lower()}"
+                for name, value in sorted(params.items())
+            ]
+        )
+        with db.connection() as conn:
+            row = conn.execute(
+                "SELECT response FROM lastfm_cache WHERE key = ? AND fetched_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        if row:
+            return json.loads(row[0])
+
+        self._limiter.wait()
+        try:
+            with metrics.lastfm_seconds.time():
+                response = self._get_session().get(
+                    self.api_url,
+                    params={
+                        "method": method,
+                        **params,
+                        "api_key": self.api_key,
+                        "format": "json",
+                        "limit": 10,
+                    },
+                    timeout=5,
+                )
+            data = response.json()
+        except Exception as e:
+            print(f"Last.fm API failed: {e}")
+            return None
+        # Only answers and "not found" (error 6) last; outages (11, 16), key
+        # problems (10, 26) and rate limiting (29) are retried next time
+        error = data.get("error")
+        if error == 29:
+            print("Last.fm API rate limit exceeded")
+            return None
+        if error and error != NOT_FOUND:
+            print(f"Last.fm API error {error}: {data.get('message')}")
+            return None
+
+        with db.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO lastfm_cache (key, response, fetched_at) VALUES (?, ?, ?)",
+                (key, json.dumps(data), time.time()),
+            )
+        return data
+
+    def similar_tracks(self, artist, track):
+        data = self._call("track.getsimilar", artist=artist, track=track) or {}
+        tracks = data.get("similartracks", {}).get("track", [])
+        return [f"{t['artist']['name']} {t['name']}" for t in tracks[:5]]
+
+    def similar_artists(self, artist):
+        data = self._call("artist.getsimilar", artist=artist) or {}
+        artists = data.get("similarartists", {}).get("artist", [])
+        return [f"{a['name']} songs" for a in artists[:5]]
+
+    def recommendations(self, songs):
+        """Search queries similar to (title, artist) pairs, fetched in parallel
+
+        Similar tracks are preferred; similar artists fill in for songs
+        Last.fm doesn't know.
+        """
+        if not self.api_key:
+            return []
+        lookups = [
+            (
+                self._pool.submit(self.similar_tracks, artist, title),
+                self._pool.submit(self.similar_artists, artist),
+            )
+            for title, artist in songs
+        ]
+        queries = []
+        for tracks, artists in lookups:
+            try:
+                queries.extend(tracks.result() or artists.result())
+            except Exception as e:
+                print(f"Last.fm API failed: {e}")
+        return queries
@@ -0,0 +1,244 @@
+import difflib
+import json
+import os
+import re
+from urllib.parse import parse_qs, urlparse
+
+import db
+from resolve_cache import normalize_query
+
+YOUTUBE_HOSTS = {
+    "youtube.com",
+    "www.youtube.com",
+    "m.youtube.com",
+    "music.youtube.com",
+    "youtu.be",
+    "www.youtube-nocookie.com",
+}
+VIDEO_ID_RE = re.compile(r"^[\w-]{11}$")
+PATH_ID_RE = re.compile(r"^/(?:shorts|embed|live|v)/([\w-]{11})")
+FILLER_WORDS = {"by", "ft", "feat", "official", "audio", "video", "lyrics"}
+
+TITLE_WEIGHT = 10.0  # bm25 column weights; album and year count for less
+ARTIST_WEIGHT = 5.0
+FUZZY_MIN_LENGTH = 4  # Shorter words are too ambiguous to correct
+FUZZY_CUTOFF = 0.75
+
+
+def youtube_video_id(url):
+    """Video id of a YouTube watch/youtu.be/music/shorts URL, else None"""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return None
+    host = (parsed.hostname or "").lower()
+    if host not in YOUTUBE_HOSTS:
+        return None
+    if host == "youtu.be":
+        video_id = parsed.path.lstrip("/").split("/")[0]
+    else:
+        match = PATH_ID_RE.match(parsed.path)
+        video_id = (
+            match.group(1) if match else (parse_qs(parsed.query).get("v") or [""])[0]
+        )
+    return video_id if VIDEO_ID_RE.match(video_id) else None
+
+
+def _track(row):
+    video_id, title, uploader, duration, filepath = row
+    if not filepath or not os.path.exists(filepath):
+        return None
+    return {
+        "video_id": video_id,
+        "title": title,
+        "uploader": uploader,
+        "duration": duration or 0,
+        "url": filepath,
+    }
+
+
+def _words(text):
+    return set(normalize_query(text or "").split()) - FILLER_WORDS
+
+
+def by_video_id(video_id):
+    """Downloaded track for a video id (primary key lookup), or None"""
+    if not video_id:
+        return None
+    with db.connection() as conn:
+        row = conn.execute(
+            "SELECT id, title, uploader, duration, filepath FROM downloads WHERE id = ?",
+            (video_id,),
+        ).fetchone()
+    return _track(row) if row else None
+
+
+def by_title(title, artist):
+    with db.connection() as conn:
+        row = conn.execute(
+            "SELECT id, title, uploader, duration, filepath FROM downloads WHERE title = ? AND uploader = ? ORDER BY missing_since IS NOT NULL",
+            (title, artist),
+        ).fetchone()
+    return _track(row) if row else None
+
+
+def match(query):
+    """Downloaded track a free-text query clearly names, or None
+
+    Words are compared after case/accent folding, so "artist - title",
+    "title artist" and "title by artist" all match. A bare title only
+    matches when exactly one track in the library has it.
+    """
+    words = _words(query)
+    if not words:
+        return None
+    with db.connection() as conn:
+        rows = conn.execute(
+            "SELECT d.id, d.title, d.uploader, d.duration, d.filepath FROM library_fts f JOIN downloads d ON d.id = f.video_id WHERE library_fts MATCH ? AND d.missing_since IS NULL",
+            ("{title artist} : " + " ".join(f'"{word}"' for word in words),),
+        ).fetchall()
+    title_only = []
+    for row in rows:
+        title_words = _words(row[1])
+        if words == title_words | _words(row[2]):
+            track = _track(row)
+            if track:
+                return track
+        elif words == title_words:
+            title_only.append(row)
+    if len(title_only) == 1:
+        return _track(title_only[0])
+    return None
+
+
+def _search(conn, expression, limit):
+    return conn.execute(
+        f"""
+        SELECT d.id, d.title, d.uploader, d.album, d.year, d.duration, d.url, d.filepath
+        FROM library_fts f JOIN downloads d ON d.id = f.video_id
+        WHERE library_fts MATCH ? AND d.missing_since IS NULL
+        ORDER BY bm25(library_fts, 0.0, {TITLE_WEIGHT}, {ARTIST_WEIGHT}, 2.0, 1.0)
+        LIMIT ?
+        """,
+        (expression, limit),
+    ).fetchall()
+
+
+def _similar_terms(conn, word):
+    """Indexed words within a typo or two of `word` (same first letter)"""
+    terms = [
+        term
+        for (term,) in conn.execute(
+            "SELECT term FROM library_vocab WHERE term >= ? AND term < ?",
+            (word[0], word[0] + "\uffff"),
+        )
+    ]
+    return difflib.get_close_matches(word, terms, n=3, cutoff=FUZZY_CUTOFF)
+
+
+def search(query, limit=20):
+    """Library tracks for a partial query, best first
+
+    Every word is matched as a prefix, so results follow the user's typing.
+    When that finds fewer than `limit` tracks, words are also expanded to
+    similar indexed words (typos) and those matches are ranked after.
+    """
+    words = normalize_query(query).split()
+    if not words:
+        return []
+    with db.connection() as conn:
+        rows = _search(conn, " ".join(f'"{word}"*' for word in words), limit)
+        if len(rows) < limit:
+            alternatives = []
+            for word in words:
+                options = [f'"{word}"*']
+                if len(word) >= FUZZY_MIN_LENGTH:
+                    options += [f'"{term}"' for term in _similar_terms(conn, word)]
+                alternatives.append(f"({' OR '.join(options)})")
+            if any(" OR " in option for option in alternatives):
+                seen = {row[0] for row in rows}
+                rows += [
+                    row
+                    for row in _search(conn, " AND ".join(alternatives), limit)
+                    if row[0] not in seen
+                ][: limit - len(rows)]
+    return [
+        {
+            "video_id": video_id,
+            "title": title,
+            "uploader": uploader,
+            "album": album or None,
+            "year": year or None,
+            "duration": duration or 0,
+            "webpage_url": url,
+        }
+        for video_id, title, uploader, album, year, duration, url, filepath in rows
+        if filepath and os.path.exists(filepath)
+    ]
+
+
+def info_json_path(filepath):
+    directory, name = os.path.split(filepath)
+    return os.path.join(directory, "metadata", os.path.splitext(name)[0] + ".info.json")
+
+
+def read_info(filepath):
+    """The info JSON yt-dlp saved next to a track, or {}"""
+    try:
+        with open(info_json_path(filepath), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_metadata(filepath):
+    """(album, year) from the info JSON yt-dlp saved next to a track"""
+    info = read_info(filepath)
+    year = info.get("release_year") or (info.get("release_date") or "")[:4]
+    return info.get("album") or "", str(year or "")
+
+
+def add(video_id, title, uploader, duration, url, filepath):
+    """Record a downloaded track; the search index follows via triggers"""
+    album, year = read_metadata(filepath)
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        stat = None
+    with db.connection() as conn:
+        record(
+            conn, video_id, title, uploader, duration, url, filepath, album, year, stat
+        )
+
+
+def record(conn, video_id, title, uploader, duration, url, filepath, album, year, stat):
+    """Upsert a track file and its fingerprint, so scans won't re-read it"""
+    conn.execute(
+        """
+        INSERT INTO downloads (id, title, uploader, duration, url, filepath, album, year)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            title = excluded.title,
+            uploader = excluded.uploader,
+            duration = excluded.duration,
+            url = COALESCE(excluded.url, url),
+            filepath = excluded.filepath,
+            album = excluded.album,
+            year = excluded.year,
+            missing_since = NULL,
+            evicted_at = NULL,
+            evicted_bytes = NULL
+        """,
+        (video_id, title, uploader, duration, url, filepath, album, year),
+    )
+    if stat:
+        conn.execute(
+            "INSERT OR REPLACE INTO library_files (path, dir, mtime, size, video_id) VALUES (?, ?, ?, ?, ?)",
+            (
+                filepath,
+                os.path.dirname(filepath),
+                stat.st_mtime,
+                stat.st_size,
+                video_id,
+            ),
+        )
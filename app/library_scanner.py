@@ -0,0 +1,290 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+import db
+import library
+
+try:  # Optional: read embedded tags from files the jukebox didn't download
+    import mutagen
+except ImportError:
+    mutagen = None
+
+AUDIO_EXTENSIONS = {
+    ".aac",
+    ".flac",
+    ".m4a",
+    ".mp3",
+    ".ogg",
+    ".opus",
+    ".wav",
+    ".webm",
+}
+SKIP_DIRS = {"metadata"}  # yt-dlp sidecars, not music
+YEAR_ALBUM_RE = re.compile(r"^(\d{4}) (.+)$")  # "2023 Album Name"
+
+
+class LibraryScanner:
+    """Reconciles the music directory with the downloads table
+
+    Directories are fingerprinted by mtime: one whose mtime hasn't changed
+    still has the same entries, so it is skipped and its known
+    subdirectories are visited from the database. In changed directories
+    only files with a new mtime/size are read (sidecar info JSON, then
+    tags, then the file name). Files that vanish are marked missing.
+    Fingerprints are committed per directory, so an interrupted scan
+    resumes where it stopped.
+    """
+
+    def __init__(self, root, interval=600):
+        self.root = root
+        self.interval = interval
+        self.last_scan = None
+        self._wake = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="library-scanner", daemon=True).start()
+        return self
+
+    def trigger(self):
+        """Scan again now instead of waiting for the interval"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Library scan failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def scan(self):
+        started = time.time()
+        stats = {"dirs": 0, "listed": 0, "imported": 0, "missing": 0}
+        stack = [self.root]
+        visited = set()  # Real paths, in case of symlink loops
+        while stack:
+            path = stack.pop()
+            try:
+                stat = os.stat(path)
+                real = os.path.realpath(path)
+            except OSError:
+                stats["missing"] += self._forget_dir(path)
+                continue
+            if real in visited:
+                continue
+            visited.add(real)
+            stats["dirs"] += 1
+            with db.connection() as conn:
+                known = conn.execute(
+                    "SELECT mtime FROM library_dirs WHERE path = ?", (path,)
+                ).fetchone()
+                children = [
+                    child
+                    for (child,) in conn.execute(
+                        "SELECT path FROM library_dirs WHERE parent = ?", (path,)
+                    )
+                ]
+            if known and known[0] == stat.st_mtime:
+                stack.extend(children)
+                continue
+            subdirs, imported, missing = self._scan_dir(path, stat, children)
+            stats["listed"] += 1
+            stats["imported"] += imported
+            stats["missing"] += missing
+            stack.extend(subdirs)
+        stats["missing"] += self._check_untracked()
+        stats["seconds"] = round(time.time() - started, 2)
+        self.last_scan = stats
+        if stats["listed"] or stats["missing"]:
+            print(
+                f"📚 Library scan: {stats['listed']}/{stats['dirs']} dirs changed, "
+                f"{stats['imported']} imported, {stats['missing']} missing "
+                f"({stats['seconds']}s)"
+            )
+        return stats
+
+    def _scan_dir(self, path, stat, known_children):
+        subdirs, files = [], {}
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return [], 0, 0
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if entry.name not in SKIP_DIRS and not entry.name.startswith("."):
+                        subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    files[entry.path] = entry.stat()
+            except OSError:
+                continue
+
+        missing = 0
+        for child in set(known_children) - set(subdirs):
+            missing += self._forget_dir(child)
+
+        now = time.time()
+        imported = 0
+        with db.connection() as conn:
+            fingerprints = {
+                file_path: (mtime, size)
+                for file_path, mtime, size in conn.execute(
+                    "SELECT path, mtime, size FROM library_files WHERE dir = ?", (path,)
+                )
+            }
+            for file_path in set(fingerprints) - set(files):
+                missing += _mark_missing(conn, file_path, now)
+            for file_path, file_stat in files.items():
+                if fingerprints.get(file_path) == (
+                    file_stat.st_mtime,
+                    file_stat.st_size,
+                ):
+                    continue
+                track = read_track(conn, file_path)
+                library.record(conn, **track, filepath=file_path, stat=file_stat)
+                imported += 1
+            # Recorded last: until this commits, a restart rescans the dir
+            conn.execute(
+                "INSERT OR REPLACE INTO library_dirs (path, parent, mtime) VALUES (?, ?, ?)",
+                (
+                    path,
+                    os.path.dirname(path) if path != self.root else None,
+                    stat.st_mtime,
+                ),
+            )
+        return subdirs, imported, missing
+
+    def _forget_dir(self, path):
+        """Mark every file under a vanished directory missing"""
+        now = time.time()
+        prefix = path.rstrip("/") + "/"
+        with db.connection() as conn:
+            files = [
+                file_path
+                for (file_path,) in conn.execute(
+                    "SELECT path FROM library_files WHERE dir = ? OR substr(dir, 1, ?) = ?",
+                    (path, len(prefix), prefix),
+                )
+            ]
+            missing = sum(_mark_missing(conn, file_path, now) for file_path in files)
+            conn.execute(
+                "DELETE FROM library_dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                (path, len(prefix), prefix),
+            )
+        return missing
+
+    def _check_untracked(self):
+        """Mark missing downloads the scanner has no fingerprint for"""
+        now = time.time()
+        with db.connection() as conn:
+            rows = conn.execute(
+                "SELECT filepath FROM downloads WHERE missing_since IS NULL AND filepath IS NOT NULL AND filepath NOT IN (SELECT path FROM library_files)"
+            ).fetchall()
+            return sum(
+                _mark_missing(conn, filepath, now)
+                for (filepath,) in rows
+                if not os.path.exists(filepath)
+            )
+
+
+def _mark_missing(conn, filepath, now):
+    conn.execute("DELETE FROM library_files WHERE path = ?", (filepath,))
+    return conn.execute(
+        "UPDATE downloads SET missing_since = ? WHERE filepath = ? AND missing_since IS NULL",
+        (now, filepath),
+    ).rowcount
+
+
+def read_tags(filepath):
+    """Title/artist/album/year/duration from embedded tags, if mutagen is installed"""
+    if mutagen is None:
+        return {}
+    try:
+        audio = mutagen.File(filepath, easy=True)
+    except Exception:
+        return {}
+    if audio is None:
+        return {}
+
+    def first(key):
+        values = audio.get(key) if audio.tags is not None else None
+        return str(values[0]).strip() if values else None
+
+    return {
+        "title": first("title"),
+        "artist": first("artist") or first("albumartist"),
+        "album": first("album"),
+        "year": (first("date") or "")[:4] or None,
+        "duration": getattr(audio.info, "length", None),
+    }
+
+
+def read_track(conn, filepath):
+    """downloads fields for a file: sidecar info JSON, then tags, then its path
+
+    Files laid out as Artist/Year Album/Artist - Title.ext need no tags. A
+    file without a video id takes over a row with the same title and artist
+    whose file is gone (it was moved), whether or not the scan has reached
+    the old location yet; otherwise it gets a stable local: id from its path.
+    """
+    info = library.read_info(filepath)
+    tags = {} if info.get("id") else read_tags(filepath)
+    directory, name = os.path.split(filepath)
+    stem = os.path.splitext(name)[0]
+    name_artist, _, name_title = stem.partition(" - ")
+    if not name_title:
+        name_artist, name_title = None, stem
+    parent = os.path.basename(directory)
+    year_album = YEAR_ALBUM_RE.match(parent)
+    if year_album:
+        dir_artist = os.path.basename(os.path.dirname(directory))
+    else:
+        dir_artist = parent
+
+    title = info.get("title") or tags.get("title") or name_title
+    artist = (
+        info.get("artist")
+        or info.get("uploader")
+        or tags.get("artist")
+        or name_artist
+        or dir_artist
+    )
+    video_id = info.get("id")
+    if not video_id:
+        rows = conn.execute(
+            "SELECT id, filepath, missing_since FROM downloads WHERE title = ? AND uploader = ?",
+            (title, artist),
+        ).fetchall()
+        # The file's own row (re-read after a change), else one it moved from
+        video_id = next(
+            (row_id for row_id, old_path, _ in rows if old_path == filepath), None
+        ) or next(
+            (
+                row_id
+                for row_id, old_path, missing_since in rows
+                if missing_since is not None or not os.path.exists(old_path or "")
+            ),
+            "local:" + hashlib.sha1(filepath.encode()).hexdigest()[:16],
+        )
+    year = (
+        info.get("release_year")
+        or (info.get("release_date") or "")[:4]
+        or tags.get("year")
+        or (year_album and year_album.group(1))
+    )
+    return {
+        "video_id": video_id,
+        "title": title,
+        "uploader": artist,
+        "duration": int(info.get("duration") or tags.get("duration") or 0),
+        "url": info.get("webpage_url"),
+        "album": info.get("album")
+        or tags.get("album")
+        or (year_album and year_album.group(2))
+        or "",
+        "year": str(year or ""),
+    }
@@ -0,0 +1,245 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; yt-dlp and Last.fm calls land in the upper half, IPC and SQLite
+# in the lower
+DEFAULT_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5)
+
+_registry = []
+startup_phases = {}  # phase -> seconds
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and two additions"""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1  # The slot past the buckets is +Inf
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, values in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                total += count
+                labels = _labels(self.labels + ("le",), key + (bound,))
+                yield f"{self.name}_bucket{labels} {total}"
+            labels = _labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {values[-1]:.6f}"
+            yield f"{self.name}_count{labels} {total}"
+
+
+class Gauge:
+    """Read at scrape time from `collect()`: a number or {label value: number}"""
+
+    def __init__(self, name, help, collect, label=None):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label = label
+        _registry.append(self)
+
+    def render(self):
+        try:
+            value = self.collect()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}")
+            return  # Left out entirely, HELP included
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if self.label:
+            for key, number in sorted(value.items()):
+                yield f"{self.name}{_labels((self.label,), (key,))} {number}"
+        else:
+            yield f"{self.name} {value}"
+
+
+class TimedLock:
+    """threading.Lock that tracks how long it is held
+
+    The bookkeeping happens while the lock is still held, so it adds two
+    perf_counter() calls per acquisition and no extra locking.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self.held_total = 0.0
+        self.max_hold = 0.0  # Since the last take_max_hold()
+
+    def acquire(self, blocking=True, timeout=-1):
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self.held_total += held
+        if held > self.max_hold:
+            self.max_hold = held
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def take_max_hold(self):
+        """Longest hold since the previous call"""
+        held, self.max_hold = self.max_hold, 0.0
+        return held
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+@contextmanager
+def startup_phase(name):
+    """Time one step of starting up, log it and keep it for /metrics"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = round(time.perf_counter() - started, 3)
+        print(f"⏱️ Startup: {name} took {startup_phases[name] * 1000:.0f} ms")
+
+
+def process_uptime():
+    """Seconds since this process was launched, interpreter start included
+
+    Read from /proc (Linux and Android); None where that isn't available.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesized command name; starttime is 22nd
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - started / os.sysconf("SC_CLK_TCK")
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Shared by the modules that do the timed work
+ytdlp_seconds = Histogram(
+    "jukebox_ytdlp_seconds", "yt-dlp search and extraction time", labels=("op",)
+)
+lastfm_seconds = Histogram(
+    "jukebox_lastfm_request_seconds", "Last.fm API request time (cache misses)"
+)
+sqlite_seconds = Histogram(
+    "jukebox_sqlite_query_seconds",
+    "SQLite statement execution time",
+    buckets=FAST_BUCKETS,
+)
+mpv_ipc_seconds = Histogram(
+    "jukebox_mpv_ipc_seconds",
+    "mpv IPC command round trip time",
+    labels=("command",),
+    buckets=FAST_BUCKETS,
+)
+add_to_play_seconds = Histogram(
+    "jukebox_add_to_play_seconds",
+    "Time from /add until the player started the track",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300, 900, 1800, 3600),
+)
+resolve_cache_hits = Counter(
+    "jukebox_resolve_cache_hits_total",
+    "Resolves answered without yt-dlp",
+    labels=("source",),
+)
+resolve_failures = Counter(
+    "jukebox_resolve_failures_total", "Resolves that found nothing playable"
+)
+autoplay_duplicates = Counter(
+    "jukebox_autoplay_duplicates_skipped_total",
+    "Autoplay suggestions skipped as queued, playing or recently played",
+)
+library_evicted_bytes = Counter(
+    "jukebox_library_evicted_bytes_total",
+    "Bytes of downloaded audio deleted to stay under the storage quota",
+)
+autoplay_suggestions = Counter(
+    "jukebox_autoplay_suggestions_total",
+    "Autoplay songs queued, by where the suggestion came from",
+    labels=("source",),
+)
+Gauge(
+    "jukebox_startup_phase_seconds",
+    "How long each startup phase took",
+    lambda: startup_phases,
+    label="phase",
+)
@@ -0,0 +1,213 @@
+import itertools
+import json
+import socket
+import threading
+import time
+
+import metrics
+
+
+class MpvError(Exception):
+    pass
+
+
+class MpvClient:
+    """Long-lived JSON IPC connection to mpv.
+
+    One reader thread owns the socket: it matches replies to requests by
+    ``request_id``, keeps a cache of observed properties and forwards every
+    other event (``end-file``, ``playback-restart``...) to listeners.
+    Listeners run on the reader thread, so they must not block or call
+    ``command()``.
+    """
+
+    OBSERVED = ("pause", "idle-active", "duration", "playlist-pos")
+
+    def __init__(self, path, observe=OBSERVED):
+        self.path = path
+        self.observe = tuple(observe)
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}  # request_id -> callback(reply)
+        self._pending_lock = threading.Lock()
+        self._listeners = []
+        self._props = {}
+        self._props_lock = threading.Lock()
+        # time-pos is not observed (it changes on every playback tick); it is
+        # interpolated from an anchor refreshed on seeks, loads and pauses.
+        self._pos_anchor = (0.0, time.monotonic())
+        self._connected = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mpv-ipc", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add_listener(self, fn):
+        """Register ``fn(event)`` for every non-reply message from mpv."""
+        self._listeners.append(fn)
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def send(self, *args, callback=None):
+        """Fire a command without waiting; ``callback(reply)`` gets the reply."""
+        request_id = next(self._ids)
+        if callback:
+            with self._pending_lock:
+                self._pending[request_id] = callback
+        line = json.dumps({"command": list(args), "request_id": request_id}) + "\n"
+        try:
+            with self._send_lock:
+                if self._sock is None:
+                    raise OSError("mpv not connected")
+                self._sock.sendall(line.encode())
+            return True
+        except OSError:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            return False
+
+    def command(self, *args, timeout=2.0):
+        """Run a command and return its ``data``; raises MpvError on failure."""
+        done = threading.Event()
+        result = {}
+
+        def on_reply(reply):
+            result.update(reply)
+            done.set()
+
+        started = time.perf_counter()
+        if not self.send(*args, callback=on_reply):
+            raise MpvError("mpv not connected")
+        if not done.wait(timeout):
+            raise MpvError(f"mpv timed out on {args[0]}")
+        metrics.mpv_ipc_seconds.observe(time.perf_counter() - started, command=args[0])
+        if result.get("error") != "success":
+            raise MpvError(result.get("error", "unknown error"))
+        return result.get("data")
+
+    def get(self, name, default=None):
+        with self._props_lock:
+            value = self._props.get(name)
+        return default if value is None else value
+
+    def position(self):
+        """Current playback position in seconds, without any socket I/O."""
+        with self._props_lock:
+            pos, since = self._pos_anchor
+            if self._props.get("pause") or self._props.get("idle-active"):
+                return pos
+        return pos + (time.monotonic() - since)
+
+    def seek(self, pos):
+        """Seek to an absolute position and move the cached anchor right away."""
+        if not self.send("set_property", "time-pos", pos):
+            raise MpvError("mpv not connected")
+        self._set_anchor(pos)
+
+    def snapshot(self):
+        with self._props_lock:
+            props = dict(self._props)
+        props["time-pos"] = self.position()
+        return props
+
+    def _set_anchor(self, pos):
+        with self._props_lock:
+            self._pos_anchor = (float(pos or 0), time.monotonic())
+
+    def _refresh_position(self):
+        def on_reply(reply):
+            if reply.get("error") == "success":
+                self._set_anchor(reply.get("data"))
+
+        self.send("get_property", "time-pos", callback=on_reply)
+
+    def _run(self):
+        backoff = 0.1
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            backoff = 0.1
+            with self._send_lock:
+                self._sock = sock
+            self._connected.set()
+            for observe_id, name in enumerate(self.observe, start=1):
+                self.send("observe_property", observe_id, name)
+            self._refresh_position()
+            try:
+                self._read(sock)
+            except OSError:
+                pass
+            self._disconnect(sock)
+            print("⚠️ Lost mpv IPC connection, reconnecting")
+
+    def _read(self, sock):
+        buf = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    try:
+                        self._dispatch(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def _dispatch(self, msg):
+        if "request_id" in msg and "event" not in msg:
+            with self._pending_lock:
+                callback = self._pending.pop(msg["request_id"], None)
+            if callback:
+                callback(msg)
+            return
+
+        event = msg.get("event")
+        if event == "property-change":
+            name = msg.get("name")
+            with self._props_lock:
+                previous = self._props.get(name)
+                self._props[name] = msg.get("data")
+            if name == "pause" and msg.get("data") != previous:
+                # Freeze or resume the interpolated position at the switch.
+                self._set_anchor(self._anchor_value(previous))
+                self._refresh_position()
+        elif event in ("playback-restart", "seek", "file-loaded"):
+            self._refresh_position()
+        elif event == "end-file":
+            self._set_anchor(0)
+
+        for listener in self._listeners:
+            try:
+                listener(msg)
+            except Exception as e:
+                print(f"mpv listener failed: {e}")
+
+    def _anchor_value(self, was_paused):
+        with self._props_lock:
+            pos, since = self._pos_anchor
+        return pos if was_paused else pos + (time.monotonic() - since)
+
+    def _disconnect(self, sock):
+        self._connected.clear()
+        with self._send_lock:
+            self._sock = None
+        sock.close()
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for callback in pending.values():
+            callback({"error": "disconnected"})
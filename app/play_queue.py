@@ -0,0 +1,139 @@
+from collections import Counter, OrderedDict
+from itertools import chain, islice
+
+
+def song_key(item):
+    return f"{item.get('title')}-{item.get('uploader')}"
+
+
+class PlayQueue:
+    """Upcoming tracks: user picks first, then autoplay filler
+
+    Each segment is an OrderedDict keyed by item id, so lookups, removals,
+    "play next", "after the last user pick" and popping the head are all
+    O(1); only moving to an arbitrary position rebuilds a segment. Items
+    are plain dicts (what /queue serializes) and are updated in place.
+    Not thread-safe: callers hold state_lock.
+    """
+
+    def __init__(self):
+        self._user = OrderedDict()
+        self._autoplay = OrderedDict()
+        self._keys = Counter()  # song_key -> entries queued with that song
+
+    def __len__(self):
+        return len(self._user) + len(self._autoplay)
+
+    def __iter__(self):
+        return chain(self._user.values(), self._autoplay.values())
+
+    def __contains__(self, item_id):
+        return item_id in self._user or item_id in self._autoplay
+
+    def get(self, item_id):
+        return self._user.get(item_id) or self._autoplay.get(item_id)
+
+    def head(self):
+        return next(iter(self), None)
+
+    def peek(self, count):
+        return list(islice(self, count))
+
+    def has_song(self, title, uploader):
+        return self._keys[f"{title}-{uploader}"] > 0
+
+    def play_next(self, item):
+        self._add(self._user, item)
+        self._user.move_to_end(item["id"], last=False)
+
+    def add_user(self, item):
+        """Queue after the last user pick, ahead of autoplay filler"""
+        self._add(self._user, item)
+
+    def add_autoplay(self, item):
+        self._add(self._autoplay, item)
+
+    def requeue(self, item):
+        """Put a popped head back at the front of the segment it came from"""
+        segment = self._autoplay if item.get("added_by") == "autoplay" else self._user
+        self._add(segment, item)
+        segment.move_to_end(item["id"], last=False)
+
+    def popleft(self):
+        segment = self._user or self._autoplay
+        if not segment:
+            return None
+        _, item = segment.popitem(last=False)
+        self._forget(item)
+        return item
+
+    def replace(self, item_id, item):
+        """Swap an entry's contents (e.g. a resolved placeholder) in place"""
+        entry = self.get(item_id)
+        if entry is None:
+            return False
+        self._forget(entry)
+        entry.clear()
+        entry.update(item, id=item_id)
+        self._keys[song_key(entry)] += 1
+        return True
+
+    def remove(self, item_id):
+        item = self._user.pop(item_id, None) or self._autoplay.pop(item_id, None)
+        if item is not None:
+            self._forget(item)
+        return item
+
+    def move(self, item_id, index):
+        """Move an entry to position `index`, within its own segment
+
+        User picks stay ahead of the autoplay filler and filler stays
+        filler, so the index is clamped to the entry's segment.
+        """
+        autoplay = item_id in self._autoplay
+        item = self.remove(item_id)
+        if item is None:
+            return False
+        if autoplay:
+            offset = max(0, min(index - len(self._user), len(self._autoplay)))
+            self._autoplay = _inserted(self._autoplay, offset, item)
+        else:
+            self._user = _inserted(
+                self._user, max(0, min(index, len(self._user))), item
+            )
+        self._keys[song_key(item)] += 1
+        return True
+
+    def clear(self, autoplay_only=False):
+        """Drop everything (or only the filler); returns how many were removed"""
+        removed = list(self._autoplay.values())
+        self._autoplay.clear()
+        if not autoplay_only:
+            removed += self._user.values()
+            self._user.clear()
+        for item in removed:
+            self._forget(item)
+        return len(removed)
+
+    def segments(self):
+        """Copies of the user and autoplay entries, in order"""
+        return {
+            "user": [dict(item) for item in self._user.values()],
+            "autoplay": [dict(item) for item in self._autoplay.values()],
+        }
+
+    def _add(self, segment, item):
+        segment[item["id"]] = item
+        self._keys[song_key(item)] += 1
+
+    def _forget(self, item):
+        key = song_key(item)
+        self._keys[key] -= 1
+        if self._keys[key] <= 0:
+            del self._keys[key]
+
+
+def _inserted(segment, index, item):
+    items = list(segment.items())
+    items.insert(index, (item["id"], item))
+    return OrderedDict(items)
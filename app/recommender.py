@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+import db
+import library
+
+SEQUENCE_GAP = 30 * 60  # Plays further apart than this aren't a transition
+ADDER_MEMORY = 3  # A guest's picks link to their previous few picks
+SEED_WEIGHTS = (1.0, 0.5, 0.25)  # Most recent play counts most
+CO_ADDED_WEIGHT = 0.5  # Picked by the same guest, relative to played next
+ARTIST_WEIGHT = 0.2  # Any track by an artist that follows the seed's artist
+LOCAL_BOOST = 2.0  # Downloaded tracks start instantly and cost no yt-dlp call
+
+
+class LocalRecommender:
+    """Next-track suggestions from the jukebox's own listening history
+
+    Builds an in-memory graph from the plays table: consecutive plays link
+    tracks (and their artists), and tracks picked by the same guest link to
+    each other. Only plays newer than the last one seen are read on each
+    refresh(), so keeping it current costs one indexed query. Skips count
+    against a track. Tracks are (title, uploader) pairs, like song_key().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._next = defaultdict(Counter)  # track -> tracks played after it
+        self._co_added = defaultdict(Counter)  # track -> same guest's picks
+        self._artist_next = defaultdict(Counter)  # artist -> following artists
+        self._by_artist = defaultdict(set)  # artist -> tracks
+        self._plays = Counter()
+        self._skips = Counter()
+        self._previous = None  # (track, played_at) of the last play read
+        self._picks = defaultdict(lambda: deque(maxlen=ADDER_MEMORY))
+
+    def refresh(self):
+        """Fold in plays logged since the last refresh"""
+        started = time.perf_counter()
+        with self._lock:
+            first = self._last_id == 0
+            with db.connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, title, uploader, added_by, event, played_at FROM plays WHERE id > ? ORDER BY id",
+                    (self._last_id,),
+                ).fetchall()
+            for play_id, title, uploader, added_by, event, played_at in rows:
+                self._last_id = play_id
+                if title and uploader:
+                    self._add_play((title, uploader), added_by, event, played_at)
+            if first and rows:
+                print(
+                    f"🧭 Local recommendations: {len(self._plays)} tracks from "
+                    f"{len(rows)} plays ({(time.perf_counter() - started) * 1000:.0f} ms)"
+                )
+
+    def _add_play(self, track, added_by, event, played_at):
+        if event == "skip":
+            self._skips[track] += 1
+            return
+        self._plays[track] += 1
+        self._by_artist[track[1]].add(track)
+        if self._previous:
+            previous, previous_at = self._previous
+            if previous != track and played_at - previous_at < SEQUENCE_GAP:
+                self._next[previous][track] += 1
+                if previous[1] != track[1]:
+                    self._artist_next[previous[1]][track[1]] += 1
+        self._previous = (track, played_at)
+        if added_by and added_by != "autoplay":
+            picks = self._picks[added_by]
+            for other in picks:
+                if other != track:
+                    self._co_added[other][track] += 1
+                    self._co_added[track][other] += 1
+            picks.append(track)
+
+    def recommend(self, seeds, count=3, exclude=()):
+        """Up to `count` suggestions after the (title, uploader) `seeds`
+
+        Returns (query, track) pairs; `track` is the library entry when the
+        suggestion is downloaded (ranked first), else None and `query` needs
+        resolving.
+        """
+        self.refresh()
+        scores = Counter()
+        with self._lock:
+            for seed, weight in zip(seeds, SEED_WEIGHTS):
+                seed = tuple(seed)
+                self._score(scores, self._next.get(seed), weight)
+                self._score(scores, self._co_added.get(seed), weight * CO_ADDED_WEIGHT)
+                artists = self._artist_next.get(seed[1]) or {}
+                total = sum(artists.values())
+                for artist, links in artists.items():
+                    for track in self._by_artist[artist]:
+                        scores[track] += weight * ARTIST_WEIGHT * links / total
+            for track in scores:
+                plays = self._plays[track]
+                scores[track] *= plays / (plays + self._skips[track])
+        excluded = {f"{title}-{uploader}" for title, uploader in seeds}
+        excluded.update(exclude)
+        ranked = []
+        for track, score in scores.most_common():
+            if f"{track[0]}-{track[1]}" in excluded:
+                continue
+            local = library.by_title(*track)
+            ranked.append((score * LOCAL_BOOST if local else score, track, local))
+            if len(ranked) >= count * 3:  # Enough to choose the local ones from
+                break
+        ranked.sort(key=lambda entry: entry[0], reverse=True)
+        return [
+            (f"{title} {uploader}", local) for _, (title, uploader), local in ranked
+        ][:count]
+
+    @staticmethod
+    def _score(scores, links, weight):
+        if not links:
+            return
+        total = sum(links.values())
+        for track, count in links.items():
+            scores[track] += weight * count / total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracks": len(self._plays),
+                "links": sum(len(links) for links in self._next.values()),
+            }
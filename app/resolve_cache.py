@@ -0,0 +1,142 @@
+import json
+import re
+import time
+import unicodedata
+
+import db
+
+# Fields of a yt-dlp info dict worth keeping; everything resolve_media and
+# download_bg read from `info` after choosing a track.
+TRACK_FIELDS = (
+    "id",
+    "title",
+    "artist",
+    "uploader",
+    "channel",
+    "album",
+    "release_year",
+    "duration",
+    "webpage_url",
+)
+
+# googlevideo URLs carry expire=<unix time> in the query (or /expire/<t>/ in
+# manifest paths); other sources get a conservative default lifetime.
+EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+DEFAULT_STREAM_TTL = 3600
+STREAM_MARGIN = 600  # Treat URLs expiring within 10 minutes as stale
+
+
+def normalize_query(q_or_url, allow_age_restricted=False):
+    """Cache key for a search query or URL: case/spacing/accents folded"""
+    text = q_or_url.strip()
+    if not re.match(r"https?://", text):
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        text = " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+    # Age-restricted results must never be served to a non-consenting add
+    return f"age:{text}" if allow_age_restricted else text
+
+
+def stream_url_expiry(url, now=None):
+    match = EXPIRE_RE.search(url or "")
+    if match:
+        return float(match.group(1))
+    return (now or time.time()) + DEFAULT_STREAM_TTL
+
+
+def stream_url_fresh(info, now=None, until=None):
+    """Whether info["url"] will still play for a while (cached or fresh info)
+
+    `until` asks for a URL that stays valid until then instead of from now,
+    e.g. the end of a queued track.
+    """
+    now = now or time.time()
+    if not info.get("url"):
+        return False
+    expires = info.get("stream_expires") or stream_url_expiry(info["url"], now)
+    return expires > max(now, until or 0) + STREAM_MARGIN
+
+
+class ResolveCache:
+    """SQLite cache of query -> video id -> track metadata and stream URL
+
+    Query mappings expire after `ttl` seconds (search results drift), and
+    both tables are trimmed to `max_entries` by least-recent use.
+    """
+
+    def __init__(self, ttl=30 * 86400, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, query):
+        """Track info for a normalized query, or None on a miss"""
+        now = time.time()
+        with db.connection() as conn:
+            row = conn.execute(
+                "SELECT video_id FROM resolve_queries WHERE query = ? AND created_at > ?",
+                (query, now - self.ttl),
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE resolve_queries SET last_used = ? WHERE query = ?",
+                (now, query),
+            )
+            return self._get_track(conn, row[0], now)
+
+    def get_track(self, video_id):
+        with db.connection() as conn:
+            return self._get_track(conn, video_id, time.time())
+
+    def _get_track(self, conn, video_id, now):
+        row = conn.execute(
+            "SELECT info, stream_url, stream_expires FROM resolved_tracks WHERE video_id = ?",
+            (video_id,),
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE resolved_tracks SET last_used = ? WHERE video_id = ?",
+            (now, video_id),
+        )
+        info = json.loads(row[0])
+        info["url"] = row[1]
+        info["stream_expires"] = row[2] or 0
+        return info
+
+    def put(self, queries, info):
+        """Remember `info` (a yt-dlp info dict) under each normalized query"""
+        video_id = info.get("id")
+        if not video_id:
+            return
+        now = time.time()
+        track = {field: info.get(field) for field in TRACK_FIELDS}
+        with db.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO resolved_tracks (video_id, info, stream_url, stream_expires, last_used) VALUES (?, ?, ?, ?, ?)",
+                (
+                    video_id,
+                    json.dumps(track),
+                    info.get("url"),
+                    stream_url_expiry(info.get("url"), now),
+                    now,
+                ),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO resolve_queries (query, video_id, created_at, last_used) VALUES (?, ?, ?, ?)",
+                [(query, video_id, now, now) for query in queries if query],
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute(
+            "DELETE FROM resolve_queries WHERE created_at < ?", (now - self.ttl,)
+        )
+        for table, key in (
+            ("resolve_queries", "query"),
+            ("resolved_tracks", "video_id"),
+        ):
+            conn.execute(
+                f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
@@ -0,0 +1,101 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+# Lower runs first
+PRIORITY_PLAY_NEXT = 0
+PRIORITY_USER = 1
+PRIORITY_BATCH = 2  # Playlist/batch entries after the first
+PRIORITY_AUTOPLAY = 3
+
+
+class ResolverBusy(Exception):
+    pass
+
+
+class _Flight:
+    def __init__(self, priority, args):
+        self.priority = priority
+        self.args = args
+        self.started = False
+        self.future = Future()
+
+
+class ResolverPool:
+    """Fixed number of worker threads running `resolve(*args)` by priority
+
+    Submissions with the same key while one is queued or running share its
+    Future (single-flight), so a burst of identical adds costs one yt-dlp
+    extraction. At most `max_backlog` distinct keys may wait; beyond that
+    submit() raises ResolverBusy instead of piling up work on the phone.
+    """
+
+    def __init__(self, resolve, workers=2, max_backlog=32):
+        self._resolve = resolve
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self._cond = threading.Condition()
+        self._heap = []  # (priority, seq, key)
+        self._seq = itertools.count()
+        self._flights = {}  # key -> _Flight, queued or running
+        self._running = 0
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(
+                target=self._work, name=f"resolver-{i}", daemon=True
+            ).start()
+        return self
+
+    def submit(self, key, priority, *args):
+        with self._cond:
+            flight = self._flights.get(key)
+            if flight:
+                # A more urgent duplicate (play next) jumps the queue
+                if not flight.started and priority < flight.priority:
+                    flight.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), key))
+                return flight.future
+            if len(self._flights) - self._running >= self.max_backlog:
+                raise ResolverBusy(f"{self.max_backlog} resolves already waiting")
+            flight = _Flight(priority, args)
+            self._flights[key] = flight
+            heapq.heappush(self._heap, (priority, next(self._seq), key))
+            self._cond.notify()
+            return flight.future
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "backlog": len(self._flights) - self._running,
+            }
+
+    def _next_flight(self):
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                priority, _, key = heapq.heappop(self._heap)
+                flight = self._flights.get(key)
+                # Skip entries superseded by a priority bump
+                if flight and not flight.started and flight.priority == priority:
+                    flight.started = True
+                    self._running += 1
+                    return key, flight
+
+    def _work(self):
+        while True:
+            key, flight = self._next_flight()
+            try:
+                result = self._resolve(*flight.args)
+            except Exception as e:
+                flight.future.set_exception(e)
+            else:
+                flight.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._flights.pop(key, None)
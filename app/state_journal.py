@@ -0,0 +1,36 @@
+import json
+import time
+
+import db
+
+
+class StateJournal:
+    """The engine's latest state per section, kept in music.db
+
+    save() upserts only the sections it is given in one transaction, so the
+    engine batches every change of the last moment into a single write.
+    """
+
+    def save(self, sections):
+        now = time.time()
+        rows = [(name, json.dumps(data), now) for name, data in sections.items()]
+        with db.connection() as conn:
+            conn.executemany(
+                "INSERT INTO engine_state (section, data, saved_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (section) DO UPDATE SET data = excluded.data, saved_at = excluded.saved_at",
+                rows,
+            )
+
+    def load(self):
+        """({section: data}, time of the latest save or None)"""
+        with db.connection() as conn:
+            rows = conn.execute(
+                "SELECT section, data, saved_at FROM engine_state"
+            ).fetchall()
+        sections = {}
+        for section, data, _ in rows:
+            try:
+                sections[section] = json.loads(data)
+            except ValueError:
+                print(f"Ignoring unreadable saved {section}")
+        return sections, max((saved_at for *_, saved_at in rows), default=None)
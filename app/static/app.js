@@ -6,6 +6,12 @@ async function j(url, method = 'GET', body = null) {
   return response.json();
 }
 
+// Latest server state; /events only sends the sections that changed
+const state = { version: -1, now: null, queue: [], history: [] };
+let nowReceivedAt = 0;
+let etag = null;
+let pollTimer = null;
+
 // Format time helper
 const formatTime = (seconds) => {
   const mins = Math.floor(seconds / 60);
@@ -51,7 +57,7 @@ function updateNowPlaying(nowData) {
       <h2>${nowData.title}</h2>
       <div class="artist">${nowData.uploader}</div>
       <div class="progress-container">
-        <span class="progress-time">${formatTime(pos)}</span>
+        <span class="progress-time" id="pos-time">${formatTime(pos)}</span>
         <input type="range" id="seek" min="0" max="${dur}" value="${pos}">
         <span class="progress-time">${formatTime(dur)}</span>
       </div>
@@ -130,6 +136,8 @@ function updateQueue(queueData) {
     const icon = isAutoplay ? 'queue_music' : 'person';
     const addedByText = isAutoplay ? 'Auto-suggested' : item.added_by || 'Anonymous';
     const duration = item.duration ? formatTime(item.duration) : '';
+    // Songs move within their own section: picks, then auto-suggestions
+    const canMoveUp = i > 0 && (queueData[i - 1].added_by === 'autoplay') === isAutoplay;
     
     div.className = `queue-item ${item.added_by === 'autoplay' ? 'autoplay' : ''}`;
     div.innerHTML = `
@@ -138,33 +146,151 @@ function updateQueue(queueData) {
         <div class="queue-title">${item.title}</div>
         <div class="queue-meta">${item.uploader} ${duration ? `• ${duration}` : ''} • ${addedByText}</div>
       </div>
+      ${canMoveUp ? `<button class="btn btn-secondary" onclick="moveQueueItem('${item.id}', ${i - 1})" style="padding:8px;min-width:auto">
+        <span class="material-icons" style="font-size:16px">arrow_upward</span>
+      </button>` : ''}
+      <button class="btn btn-secondary" onclick="removeQueueItem('${item.id}')" style="padding:8px;min-width:auto">
+        <span class="material-icons" style="font-size:16px">close</span>
+      </button>
     `;
     listElement.appendChild(div);
   });
 }
 
+// Advance the progress bar locally between server updates
+function tickProgress() {
+  const nowData = state.now;
+  if (!nowData || nowData.paused) return;
+  const elapsed = (Date.now() - nowReceivedAt) / 1000;
+  const pos = Math.min((nowData.position || 0) + elapsed, nowData.duration || Infinity);
+  const posTime = document.getElementById('pos-time');
+  const seek = document.getElementById('seek');
+  if (posTime) posTime.textContent = formatTime(pos);
+  if (seek && document.activeElement !== seek) seek.value = pos;
+}
+
+// Reorder and remove queued songs; the change arrives via /events
+async function moveQueueItem(id, to) {
+  await j('/queue/move', 'POST', { id, to });
+}
+
+async function removeQueueItem(id) {
+  await j('/queue/remove', 'POST', { id });
+}
+
 // Replay song from history
 async function replaySong(songId) {
   // Find song in history and add it to queue
-  const data = await j('/queue');
-  const song = data.history.find(item => item.id === songId);
+  const song = state.history.find(item => item.id === songId);
   if (song) {
     add(song.title + ' ' + song.uploader, false);
   }
 }
 
-// Main refresh function
+// Merge a full state or a diff into the local copy and re-render
+function applyState(data) {
+  if (data.version < state.version) return;
+  state.version = data.version;
+  if ('now' in data) {
+    state.now = data.now;
+    nowReceivedAt = Date.now();
+    updateNowPlaying(state.now);
+    syncListener();
+  }
+  if ('history' in data) {
+    state.history = data.history;
+    updateHistory(state.history);
+  }
+  if ('queue' in data) {
+    state.queue = data.queue;
+    updateQueue(state.queue);
+  }
+}
+
+// Fetch the full state; unchanged state costs a 304
 async function refresh() {
   try {
-    const data = await j('/queue');
-    updateNowPlaying(data.now);
-    updateHistory(data.history);
-    updateQueue(data.queue);
+    const headers = etag ? { 'If-None-Match': etag } : {};
+    const response = await fetch('/queue', { headers, cache: 'no-store' });
+    if (response.status === 304) return;
+    etag = response.headers.get('ETag');
+    const data = await response.json();
+    // A restarted server starts counting versions from zero again
+    if (data.version < state.version) state.version = -1;
+    applyState(data);
   } catch (error) {
     console.error('Refresh failed:', error);
   }
 }
 
+// Push updates over Server-Sent Events, polling only as a fallback
+function connectEvents() {
+  if (!window.EventSource) {
+    pollTimer = setInterval(refresh, 2000);
+    return;
+  }
+  const source = new EventSource('/events');
+  source.addEventListener('state', (event) => {
+    if (pollTimer) {
+      clearInterval(pollTimer);
+      pollTimer = null;
+    }
+    const data = JSON.parse(event.data);
+    // A full state (after a server restart) replaces whatever we had
+    if ('queue' in data && 'history' in data && 'now' in data) state.version = -1;
+    applyState(data);
+  });
+  source.onerror = () => {
+    if (!pollTimer) pollTimer = setInterval(refresh, 2000);
+    // Turned away (server busy): keep polling, try the stream again later
+    if (source.readyState === EventSource.CLOSED) setTimeout(connectEvents, 30000);
+  };
+}
+
+// "Listen here": play the current track on this device, following the party
+const listener = { on: false, audio: null, videoId: null };
+
+function toggleListen() {
+  listener.on = !listener.on;
+  document.getElementById('listen-toggle').classList.toggle('active', listener.on);
+  if (!listener.on) {
+    if (listener.audio) listener.audio.pause();
+    listener.videoId = null;
+    return;
+  }
+  // Created inside the click so the browser allows it to play
+  if (!listener.audio) listener.audio = new Audio();
+  syncListener();
+}
+
+// Follow the server's track and position, correcting drift over 2 seconds
+async function syncListener() {
+  if (!listener.on) return;
+  const audio = listener.audio;
+  let party;
+  const sentAt = Date.now();
+  try {
+    party = await j('/party');
+  } catch (error) {
+    return;
+  }
+  if (!party.playing || !party.stream) {
+    // Nothing playing, or not downloaded yet: only the phone can play it
+    audio.pause();
+    listener.videoId = null;
+    return;
+  }
+  const position = party.position + (party.paused ? 0 : (Date.now() - sentAt) / 2000);
+  if (listener.videoId !== party.video_id) {
+    listener.videoId = party.video_id;
+    audio.src = `${party.stream}#t=${position.toFixed(1)}`;
+  } else if (Math.abs(audio.currentTime - position) > 2) {
+    audio.currentTime = position;
+  }
+  if (party.paused) audio.pause();
+  else audio.play().catch(() => {});
+}
+
 // API post helper
 async function post(url, body) {
   await j(url, 'POST', body);
@@ -180,9 +306,14 @@ async function add(query, playNext) {
   const addedBy = userInfo.alias ? `${userInfo.emoji} ${userInfo.alias}` : 'Anonymous';
   
   const allowAgeRestricted = document.getElementById('allowAgeRestricted').checked;
+  // Playlist links queue every song; their placeholders fill in as they resolve.
+  // A video link played from a playlist or mix (v= or youtu.be) is one song.
+  const url = query.trim();
+  const playlist = /^https?:\/\/\S*[?&]list=/.test(url)
+    && !/[?&]v=|youtu\.be\//.test(url);
   try {
-    const result = await j('/add', 'POST', {
-      q: query,
+    const result = await j(playlist ? '/add/batch' : '/add', 'POST', {
+      [playlist ? 'url' : 'q']: query,
       play_next: playNext,
       allow_age_restricted: allowAgeRestricted,
       by: addedBy
@@ -224,5 +355,7 @@ function toggleQR() {
 // Initialize app
 document.addEventListener('DOMContentLoaded', () => {
   refresh();
-  setInterval(refresh, 2000);
+  connectEvents();
+  setInterval(tickProgress, 1000);
+  setInterval(syncListener, 10000);
 });
\ No newline at end of file
@@ -0,0 +1,146 @@
+import glob
+import os
+import threading
+import time
+
+import db
+import metrics
+
+PLAY_CREDIT = 7 * 86400  # Each play keeps a track as long as a week of recency
+
+# Tracks the jukebox downloaded itself (a finished download job), coldest
+# first: last play (or download) time plus PLAY_CREDIT per play
+EVICTION_ORDER = """
+    SELECT d.id, d.filepath, f.size
+    FROM downloads d
+    JOIN download_jobs j ON j.video_id = d.id AND j.status = 'done'
+    JOIN library_files f ON f.path = d.filepath
+    LEFT JOIN (
+        SELECT video_id, COUNT(*) AS plays, MAX(played_at) AS last_played
+        FROM plays WHERE event = 'play' GROUP BY video_id
+    ) p ON p.video_id = d.id
+    WHERE d.pinned = 0 AND d.missing_since IS NULL
+    ORDER BY COALESCE(p.last_played, f.mtime) + COALESCE(p.plays, 0) * ?
+"""
+USED_BYTES = """
+    SELECT COUNT(*), COALESCE(SUM(f.size), 0)
+    FROM downloads d
+    JOIN download_jobs j ON j.video_id = d.id AND j.status = 'done'
+    JOIN library_files f ON f.path = d.filepath
+    WHERE d.missing_since IS NULL
+"""
+
+
+class StorageQuota:
+    """Keeps downloaded audio under `budget` bytes (0: no limit)
+
+    Only files the jukebox downloaded count and can go; music copied to the
+    phone by hand is left alone. The coldest tracks are deleted first,
+    never pinned ones or those `protected()` names (queued or playing).
+    Evicted rows stay in downloads, marked missing, so lookups fall back
+    to resolving the track again.
+    """
+
+    def __init__(self, budget, protected=set):
+        self.budget = budget
+        self.protected = protected
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def enforce(self):
+        """Evict until the library fits the budget; returns bytes reclaimed"""
+        if not self.budget:
+            return 0
+        with self._lock:
+            with db.connection() as conn:
+                used = conn.execute(USED_BYTES).fetchone()[1]
+                if used <= self.budget:
+                    return 0
+                candidates = conn.execute(EVICTION_ORDER, (PLAY_CREDIT,)).fetchall()
+            protected = self.protected()
+            reclaimed = evicted = 0
+            for video_id, filepath, size in candidates:
+                if used <= self.budget:
+                    break
+                if video_id in protected:
+                    continue
+                freed = _delete_track(filepath)
+                now = time.time()
+                with db.connection() as conn:
+                    conn.execute(
+                        "UPDATE downloads SET missing_since = ?, evicted_at = ?, evicted_bytes = ? WHERE id = ?",
+                        (now, now, freed, video_id),
+                    )
+                    conn.execute(
+                        "DELETE FROM library_files WHERE path = ?", (filepath,)
+                    )
+                used -= size
+                reclaimed += freed
+                evicted += 1
+            metrics.library_evicted_bytes.inc(reclaimed)
+            self.last_run = {
+                "at": time.time(),
+                "evicted_tracks": evicted,
+                "reclaimed_bytes": reclaimed,
+            }
+        print(
+            f"🧹 Library quota: evicted {evicted} tracks, "
+            f"{reclaimed / 1048576:.1f} MB reclaimed, {used / 1048576:.1f} MB used"
+        )
+        return reclaimed
+
+    def pin(self, video_id, pinned=True):
+        """Protect a downloaded track from eviction (or stop protecting it)"""
+        with db.connection() as conn:
+            return conn.execute(
+                "UPDATE downloads SET pinned = ? WHERE id = ?",
+                (int(bool(pinned)), video_id),
+            ).rowcount
+
+    def used_bytes(self):
+        with db.connection() as conn:
+            return conn.execute(USED_BYTES).fetchone()[1]
+
+    def report(self):
+        """Budget, bytes used and everything reclaimed so far"""
+        with db.connection() as conn:
+            tracks, used = conn.execute(USED_BYTES).fetchone()
+            pinned = conn.execute(
+                "SELECT COUNT(*) FROM downloads WHERE pinned = 1"
+            ).fetchone()[0]
+            evicted, reclaimed = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(evicted_bytes), 0) FROM downloads WHERE evicted_at IS NOT NULL"
+            ).fetchone()
+        return {
+            "budget_bytes": self.budget or None,
+            "used_bytes": used,
+            "tracks": tracks,
+            "pinned": pinned,
+            "evicted_tracks": evicted,
+            "reclaimed_bytes": reclaimed,
+            "last_run": self.last_run,
+        }
+
+
+def _delete_track(filepath):
+    """Delete a track and its metadata sidecars; returns the bytes freed"""
+    directory, name = os.path.split(filepath)
+    metadata_dir = os.path.join(directory, "metadata")
+    sidecars = glob.glob(
+        os.path.join(glob.escape(metadata_dir), glob.escape(os.path.splitext(name)[0]))
+        + ".*"
+    )
+    freed = 0
+    for path in [filepath, *sidecars]:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except OSError as e:
+            print(f"Evicting {path} failed: {e}")
+    for path in (metadata_dir, directory):  # Only if now empty
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+    return freed
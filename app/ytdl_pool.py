@@ -0,0 +1,143 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+COOKIE_CHECK_INTERVAL = 10  # Seconds between stat() checks of the cookie files
+
+
+class CookieWatcher:
+    """The first cookie file that exists, and a generation bumped on change
+
+    A file counts as changed when it appears, disappears or its mtime/size
+    differ. Checks are throttled to one per `interval`, so borrowing an
+    instance costs at most a few stat() calls instead of a jar parse.
+    """
+
+    def __init__(self, paths, interval=COOKIE_CHECK_INTERVAL):
+        self.paths = paths
+        self.interval = interval
+        self.generation = 0
+        self.path = None
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """(generation, cookie file or None)"""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.interval:
+                self._checked_at = now
+                signature = self._stat()
+                if signature != self._signature:
+                    self._signature = signature
+                    self.generation += 1
+                    self.path = signature[0] if signature else None
+                    if self.path:
+                        print(f"🍪 Using cookies from: {self.path}")
+                    elif self.generation > 1:
+                        print("🍪 Cookie file gone, continuing without cookies")
+            return self.generation, self.path
+
+    def _stat(self):
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            return path, stat.st_mtime_ns, stat.st_size
+        return None
+
+
+class _Instance:
+    def __init__(self, generation):
+        self.generation = generation
+        self.ydl = None
+        self.progress_hook = None  # The current borrower's
+
+    def on_progress(self, d):
+        if self.progress_hook:
+            self.progress_hook(d)
+
+
+class YoutubeDLPool:
+    """Up to `size` long-lived YoutubeDL instances, one borrower at a time each
+
+    Instances keep their extractors, cookie jar and HTTP connections between
+    uses. They are built on first borrow from `make(opts)`, and rebuilt when
+    the cookie file changes; the stale ones are dropped without writing
+    their jar back over the new file.
+    """
+
+    def __init__(self, make, opts, cookies, size=2):
+        self._make = make
+        self.opts = opts
+        self.cookies = cookies
+        self.size = size
+        self._idle = queue.LifoQueue()  # Most recently used has warm connections
+        self._created = 0
+        self._created_lock = threading.Lock()
+
+    def _build(self):
+        generation, cookie_path = self.cookies.current()
+        instance = _Instance(generation)
+        opts = {**self.opts, "progress_hooks": [instance.on_progress]}
+        if cookie_path:
+            opts["cookiefile"] = cookie_path
+        instance.ydl = self._make(opts)
+        return instance
+
+    def _discard(self, instance):
+        instance.ydl.params["cookiefile"] = None  # close() would save the jar
+        try:
+            instance.ydl.close()
+        except Exception as e:
+            print(f"Closing yt-dlp instance failed: {e}")
+
+    def _take(self):
+        try:
+            instance = self._idle.get_nowait()
+        except queue.Empty:
+            with self._created_lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            if not grow:
+                instance = self._idle.get()
+            else:
+                try:
+                    return self._build()
+                except Exception:
+                    with self._created_lock:
+                        self._created -= 1
+                    raise
+        if instance.generation != self.cookies.current()[0]:
+            self._discard(instance)
+            try:
+                instance = self._build()
+            except Exception:
+                with self._created_lock:
+                    self._created -= 1
+                raise
+        return instance
+
+    @contextmanager
+    def borrow(self, progress_hook=None, **params):
+        """A pooled YoutubeDL, with `params` (outtmpl, ratelimit...) set for this use"""
+        instance = self._take()
+        ydl = instance.ydl
+        saved = {key: ydl.params.get(key) for key in params}
+        ydl.params.update(params)
+        instance.progress_hook = progress_hook
+        try:
+            yield ydl
+        finally:
+            ydl.params.update(saved)
+            instance.progress_hook = None
+            self._idle.put(instance)
+
+    def stats(self):
+        with self._created_lock:
+            return {"size": self.size, "created": self._created}
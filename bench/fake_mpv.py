@@ -0,0 +1,183 @@
+"""Stand-in mpv for benchmarks: speaks enough of the JSON IPC protocol
+
+Started by the jukebox in place of mpv (run.py puts an `mpv` shim first on
+PATH). Tracks "play" for FAKE_MPV_TRACK_SECONDS and then end with eof, so
+the player loop, preloading and autoplay run as they would on the phone.
+"""
+
+import itertools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+TRACK_SECONDS = float(os.environ.get("FAKE_MPV_TRACK_SECONDS", "5"))
+
+
+class FakeMpv:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.clients = []
+        self.observed = {}  # property name -> observe ids
+        self.playlist = []  # [(entry id, url)]
+        self.pos = -1
+        self.pause = False
+        self.started_at = 0.0
+        self.token = None
+        self.entry_ids = itertools.count(1)
+
+    def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX)
+        server.bind(self.path)
+        server.listen()
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def emit(self, event):
+        line = (json.dumps(event) + "\n").encode()
+        for conn in list(self.clients):
+            try:
+                conn.sendall(line)
+            except OSError:
+                self.clients.remove(conn)
+
+    def prop(self, name):
+        idle = self.pos < 0
+        return {
+            "pause": self.pause,
+            "idle-active": idle,
+            "duration": None if idle else TRACK_SECONDS,
+            "playlist-pos": self.pos,
+            "playlist-count": len(self.playlist),
+            "time-pos": None if idle else time.monotonic() - self.started_at,
+        }.get(name)
+
+    def notify(self, *names):
+        for name in names:
+            for observe_id in self.observed.get(name, ()):
+                self.emit(
+                    {
+                        "event": "property-change",
+                        "id": observe_id,
+                        "name": name,
+                        "data": self.prop(name),
+                    }
+                )
+
+    def play(self, index):
+        self.pos = index
+        self.started_at = time.monotonic()
+        token = self.token = object()
+        entry_id = self.playlist[index][0]
+        self.emit({"event": "start-file", "playlist_entry_id": entry_id})
+        self.emit({"event": "file-loaded"})
+        self.emit({"event": "playback-restart"})
+        self.notify("idle-active", "playlist-pos", "duration")
+        threading.Timer(TRACK_SECONDS, self.finish, args=(token,)).start()
+
+    def finish(self, token):
+        with self.lock:
+            if token is not self.token:
+                return
+            self.end("eof")
+            if self.pos + 1 < len(self.playlist):
+                self.play(self.pos + 1)
+            else:
+                self.idle()
+
+    def end(self, reason):
+        if self.pos >= 0:
+            entry_id = self.playlist[self.pos][0]
+            self.emit(
+                {"event": "end-file", "reason": reason, "playlist_entry_id": entry_id}
+            )
+
+    def idle(self):
+        self.token = None
+        self.pos = -1
+        self.notify("idle-active", "playlist-pos", "duration")
+
+    def run(self, command):
+        name, args = command[0], command[1:]
+        if name == "observe_property":
+            self.observed.setdefault(args[1], []).append(args[0])
+            self.notify(args[1])
+        elif name == "get_property":
+            return self.prop(args[0])
+        elif name == "set_property":
+            if args[0] == "pause":
+                self.pause = bool(args[1])
+                self.notify("pause")
+            elif args[0] == "time-pos":
+                self.started_at = time.monotonic() - float(args[1])
+                self.emit({"event": "playback-restart"})
+        elif name == "loadfile":
+            mode = args[1] if len(args) > 1 else "replace"
+            entry_id = next(self.entry_ids)
+            if mode == "replace":
+                self.end("stop")
+                self.playlist = [(entry_id, args[0])]
+                self.play(0)
+            else:
+                self.playlist.append((entry_id, args[0]))
+                if self.pos < 0:
+                    self.play(len(self.playlist) - 1)
+            return {"playlist_entry_id": entry_id}
+        elif name == "stop":
+            self.end("stop")
+            self.playlist = []
+            self.idle()
+        elif name == "playlist-next":
+            if self.pos + 1 >= len(self.playlist):
+                raise ValueError("no next entry")
+            self.end("stop")
+            self.play(self.pos + 1)
+        elif name == "playlist-clear":
+            self.playlist = [self.playlist[self.pos]] if self.pos >= 0 else []
+            self.pos = 0 if self.pos >= 0 else -1
+        elif name == "playlist-remove":
+            if 0 <= args[0] < len(self.playlist) and args[0] != self.pos:
+                self.playlist.pop(args[0])
+                if args[0] < self.pos:
+                    self.pos -= 1
+        return None
+
+    def handle(self, conn):
+        self.clients.append(conn)
+        buffer = b""
+        while True:
+            try:
+                data = conn.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                reply = {"request_id": message.get("request_id"), "error": "success"}
+                with self.lock:
+                    try:
+                        reply["data"] = self.run(message["command"])
+                    except Exception as e:
+                        reply["error"] = str(e)
+                if message.get("request_id") is not None:
+                    conn.sendall((json.dumps(reply) + "\n").encode())
+
+
+if __name__ == "__main__":
+    path = next(
+        arg.split("=", 1)[1]
+        for arg in sys.argv
+        if arg.startswith("--input-ipc-server=")
+    )
+    FakeMpv(path).serve()
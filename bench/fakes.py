@@ -0,0 +1,137 @@
+"""In-process stand-ins for yt-dlp and Last.fm with configurable latency"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ARTISTS = ["Bench Artist", "Load Tester", "The Percentiles", "Tail Latency"]
+
+
+def video_id(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:11]
+
+
+def track_info(vid, title=None):
+    """A full (non-flat) info dict like yt-dlp returns for one video"""
+    artist = ARTISTS[sum(map(ord, vid)) % len(ARTISTS)]
+    return {
+        "id": vid,
+        "title": title or f"Song {vid[:4]}",
+        "uploader": artist,
+        "artist": artist,
+        "duration": 180,
+        "age_limit": 0,
+        "webpage_url": f"https://www.youtube.com/watch?v={vid}",
+        "url": f"https://bench.invalid/stream/{vid}?expire={int(time.time()) + 6 * 3600}",
+    }
+
+
+class FakeYoutubeDL:
+    """Drop-in for yt_dlp.YoutubeDL: searches, extraction and downloads
+
+    Each network-like call sleeps `latency` seconds (jittered ±25%);
+    downloads write a small file where yt-dlp would have.
+    """
+
+    latency = 0.3
+    calls = {"search": 0, "extract": 0, "download": 0}
+    _calls_lock = threading.Lock()
+
+    def __init__(self, opts=None):
+        self.params = dict(opts or {})  # Pooled instances get per-use params
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _wait(self, kind, factor=1.0):
+        with self._calls_lock:
+            self.calls[kind] += 1
+        time.sleep(self.latency * factor * random.uniform(0.75, 1.25))
+
+    def extract_info(self, query, download=False):
+        if query.startswith(("http://", "https://")):
+            self._wait("extract")
+            vid = parse_qs(urlparse(query).query).get("v", [video_id(query)])[0]
+            return track_info(vid)
+        if len(query) == 11 and " " not in query:  # Bare id from a flat entry
+            self._wait("extract")
+            return track_info(query)
+        self._wait("search")
+        entries = []
+        for rank in range(5):
+            vid = video_id(f"{query}#{rank}")
+            entries.append(
+                {
+                    "id": vid,
+                    "url": f"https://www.youtube.com/watch?v={vid}",
+                    "title": f"{query.title()} (Official Audio)"
+                    if rank == 0
+                    else f"{query} cover {rank}",
+                    "uploader": ARTISTS[rank % len(ARTISTS)],
+                    "duration": 180,
+                }
+            )
+        return {"entries": entries}
+
+    def download(self, urls):
+        self._wait("download", factor=3)
+        template = self.params.get("outtmpl", {})
+        for url in urls:
+            path = template.get("default", "%(id)s.%(ext)s").replace("%(ext)s", "m4a")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"\0" * 4096)
+            info_path = template.get("infojson")
+            if info_path:
+                vid = parse_qs(urlparse(url).query).get("v", [video_id(url)])[0]
+                info_path = info_path.replace("%(ext)s", "info.json")
+                os.makedirs(os.path.dirname(info_path), exist_ok=True)
+                with open(info_path, "w") as f:
+                    json.dump(track_info(vid), f)
+        return 0
+
+
+def start_fake_lastfm(latency=0.05):
+    """Serve track/artist.getsimilar on localhost; returns the API URL"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            method = params.get("method", [""])[0]
+            artist = params.get("artist", ["someone"])[0]
+            time.sleep(latency)
+            if method == "track.getsimilar":
+                body = {
+                    "similartracks": {
+                        "track": [
+                            {"name": f"{artist} similar {i}", "artist": {"name": a}}
+                            for i, a in enumerate(ARTISTS)
+                        ]
+                    }
+                }
+            else:
+                body = {"similarartists": {"artist": [{"name": a} for a in ARTISTS]}}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/2.0/"
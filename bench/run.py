@@ -0,0 +1,355 @@
+"""End-to-end load benchmark for the jukebox
+
+Runs the real player engine and Flask app in-process on a local port, with
+mpv replaced by bench/fake_mpv.py on a temp Unix socket, yt_dlp.YoutubeDL
+by a stub with configurable latency and Last.fm by a local fake server. Simulated guests
+poll /queue (with ETags, like the UI's fallback) while others burst /add
+and /skip. Results are JSON so runs can be compared across commits:
+
+    python bench/run.py --out before.json
+    python bench/run.py --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+
+
+class TimedLock:
+    """threading.Lock that records how long acquirers waited and held it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self.waits = []
+        self.holds = []
+        self.max_hold = 0.0  # Since the last take_max_hold(), as in metrics
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self.waits.append(self._acquired_at - started)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self.holds.append(held)
+        self.max_hold = max(self.max_hold, held)
+        self._lock.release()
+
+    def take_max_hold(self):
+        held, self.max_hold = self.max_hold, 0.0
+        return held
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # endpoint -> [seconds]
+        self.errors = {}
+
+    def timed(self, endpoint, call):
+        """Time one request; returns the response (None on connection errors)"""
+        started = time.perf_counter()
+        try:
+            response = call()
+        except requests.RequestException:
+            response = None
+        ok = response is not None and response.status_code < 500
+        self.add(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    def add(self, endpoint, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values):
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(max(values) if values else None),
+    }
+
+
+def setup_environment(workdir, args):
+    """Point the app at temp dirs, the fake mpv and the fake Last.fm"""
+    bindir = os.path.join(workdir, "bin")
+    os.makedirs(bindir)
+    shim = os.path.join(bindir, "mpv")
+    with open(shim, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{BENCH_DIR}/fake_mpv.py" "$@"\n')
+    os.chmod(shim, 0o755)
+
+    import fakes
+
+    os.environ.update(
+        {
+            "PATH": f"{bindir}{os.pathsep}{os.environ['PATH']}",
+            "HOME": workdir,  # Music library lands in <workdir>/storage/music
+            "DB_DIR": os.path.join(workdir, "data"),
+            "MPV_IPC": os.path.join(workdir, "mpv.sock"),
+            "ENGINE_SOCK": os.path.join(workdir, "engine.sock"),
+            "MPV_EXTRA": "",
+            "FAKE_MPV_TRACK_SECONDS": str(args.track_seconds),
+            "LASTFM_API_KEY": "bench",
+            "LASTFM_API_URL": fakes.start_fake_lastfm(args.lastfm_latency),
+        }
+    )
+    os.chdir(workdir)
+
+
+def load_app(args):
+    import fakes
+    import yt_dlp
+
+    fakes.FakeYoutubeDL.latency = args.ytdl_latency
+    yt_dlp.YoutubeDL = fakes.FakeYoutubeDL
+    sys.path.insert(0, APP_DIR)
+    import engine
+    import jukebox
+
+    # Swapped before the engine's threads start; they look the global up
+    # on every use
+    lock = TimedLock()
+    engine.state_lock = lock
+    engine.start()
+    threading.Thread(
+        target=engine.serve, args=(engine.ENGINE_SOCK,), daemon=True
+    ).start()
+    return engine, jukebox, lock
+
+
+def serve(app):
+    import logging
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No per-request lines
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def guest(base, recorder, deadline, interval):
+    """Polls /queue like the UI's fallback: conditional GETs with ETags"""
+    session = requests.Session()
+    etag = None
+    time.sleep(random.uniform(0, interval))
+    while time.monotonic() < deadline:
+        headers = {"If-None-Match": etag} if etag else {}
+        response = recorder.timed(
+            "/queue",
+            lambda: session.get(f"{base}/queue", headers=headers, timeout=30),
+        )
+        if response is not None:
+            etag = response.headers.get("ETag", etag)
+        time.sleep(interval * random.uniform(0.8, 1.2))
+
+
+def adder(base, recorder, deadline, rate, queries, burst):
+    """Adds songs in bursts of `burst`, averaging `rate` adds per second"""
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        for _ in range(burst):
+            query = random.choice(queries)
+            payload = {"q": query, "by": "bench", "play_next": random.random() < 0.1}
+            recorder.timed(
+                "/add",
+                lambda: session.post(f"{base}/add", json=payload, timeout=30),
+            )
+        time.sleep(burst / rate)
+
+
+def skipper(base, recorder, deadline, interval):
+    session = requests.Session()
+    while time.monotonic() + interval < deadline:
+        time.sleep(interval)
+        recorder.timed("/skip", lambda: session.post(f"{base}/skip", timeout=30))
+
+
+def sample_threads(samples, deadline):
+    while time.monotonic() < deadline:
+        samples.append(threading.active_count())
+        time.sleep(0.5)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="jukebox-bench-")
+    try:
+        setup_environment(workdir, args)
+        engine, jukebox, lock = load_app(args)
+        server, base = serve(jukebox.app)
+        if not engine.mpv.wait_connected(timeout=10):
+            raise SystemExit("fake mpv did not come up")
+
+        recorder = Recorder()
+        queries = [f"bench query {i}" for i in range(args.distinct_queries)]
+        deadline = time.monotonic() + args.duration
+        thread_samples = []
+        workers = [
+            threading.Thread(
+                target=guest, args=(base, recorder, deadline, args.poll_interval)
+            )
+            for _ in range(args.guests)
+        ]
+        workers += [
+            threading.Thread(
+                target=adder,
+                args=(base, recorder, deadline, args.add_rate, queries, args.burst),
+            ),
+            threading.Thread(
+                target=skipper, args=(base, recorder, deadline, args.skip_interval)
+            ),
+            threading.Thread(target=sample_threads, args=(thread_samples, deadline)),
+        ]
+        lock.waits.clear()
+        lock.holds.clear()
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        import fakes
+
+        with lock:
+            queue_length = len(engine.play_queue)
+        requests_total = sum(len(v) for v in recorder.latencies.values())
+        result = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "config": vars(args) | {"out": None, "compare": None},
+            "endpoints": {
+                endpoint: summarize(values)
+                | {"errors": recorder.errors.get(endpoint, 0)}
+                for endpoint, values in sorted(recorder.latencies.items())
+            },
+            "throughput_rps": round(requests_total / elapsed, 1),
+            "state_lock": {
+                "acquisitions": len(lock.waits),
+                "wait": summarize(lock.waits),
+                "hold": summarize(lock.holds),
+            },
+            "threads": {
+                "max": max(thread_samples, default=0),
+                "mean": round(sum(thread_samples) / max(len(thread_samples), 1), 1),
+            },
+            "ytdl_calls": dict(fakes.FakeYoutubeDL.calls),
+            "resolver": engine.resolver.stats(),
+            "queue_length": queue_length,
+        }
+        server.shutdown()
+        engine.mpv_proc.terminate()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def flatten(data, prefix=""):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(baseline, result):
+    """Print each metric next to the baseline's, with the relative change"""
+    old = dict(flatten({k: v for k, v in baseline.items() if k != "config"}))
+    new = dict(flatten({k: v for k, v in result.items() if k != "config"}))
+    print(f"{'metric':40} {baseline.get('commit')!s:>12} {result.get('commit')!s:>12}")
+    for name in sorted(old.keys() & new.keys()):
+        change = (
+            f"{(new[name] - old[name]) / old[name] * 100:+.1f}%" if old[name] else ""
+        )
+        print(f"{name:40} {old[name]:>12} {new[name]:>12} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--guests", type=int, default=30, help="polling clients")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--add-rate", type=float, default=2, help="adds per second")
+    parser.add_argument("--burst", type=int, default=5, help="adds sent back to back")
+    parser.add_argument("--skip-interval", type=float, default=4)
+    parser.add_argument("--distinct-queries", type=int, default=40)
+    parser.add_argument("--ytdl-latency", type=float, default=0.3)
+    parser.add_argument("--lastfm-latency", type=float, default=0.05)
+    parser.add_argument("--track-seconds", type=float, default=3)
+    parser.add_argument("--out", help="write the JSON result here")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    args = parser.parse_args()
+    # run() works in (and then deletes) a temporary directory
+    args.out = args.out and os.path.abspath(args.out)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+    elif not args.out:
+        print(text)
+    # Background threads (player, downloads, mpv reader) never exit
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,9 @@ cat > ~/.termux/boot/start.sh <<'SH'
 #!/data/data/com.termux/files/usr/bin/bash
 termux-wake-lock
 cd ~/jukebox
-git pull --rebase || true
 bash scripts/start_termux.sh
+# Updates apply from the next start; pulling first held up the first page
+git pull --rebase || true
 SH
 chmod +x ~/.termux/boot/start.sh
 echo "Boot script installed. Jukebox will auto-start on Termux boot."
\ No newline at end of file